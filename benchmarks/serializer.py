@@ -0,0 +1,128 @@
+"""
+Micro-benchmark of utils.serializer against the standard
+library json module on large app info payloads.
+
+Run from the repository root:
+python benchmarks/serializer.py
+"""
+
+# import modules
+import os
+import sys
+import json
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.chdir(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import utils.serializer  # noqa: E402
+
+
+def generate_app(app_id, depots, localized=False):
+    """
+    Generate app info shaped like the product info of a
+    big game with the given amount of depots.
+    """
+
+    rnd = random.Random(app_id)
+    languages = ["english", "german", "french", "schinese", "japanese"]
+
+    info = {
+        "_change_number": rnd.getrandbits(24),
+        "_missing_token": False,
+        "_sha": "%040x" % rnd.getrandbits(160),
+        "_size": rnd.getrandbits(20),
+        "appid": str(app_id),
+        "common": {
+            "name": "Example Game " + str(app_id),
+            "type": "Game",
+            "oslist": "windows,macos,linux",
+            "supported_languages": {
+                language: {"supported": "true", "full_audio": "true"}
+                for language in languages
+            },
+        },
+        "config": {
+            "launch": {
+                str(i): {"executable": "bin/game.exe", "arguments": "-steam"}
+                for i in range(10)
+            }
+        },
+        "depots": {
+            str(app_id + i): {
+                "config": {"oslist": "windows", "language": rnd.choice(languages)},
+                "manifests": {
+                    "public": {
+                        "gid": str(rnd.getrandbits(63)),
+                        "size": str(rnd.getrandbits(32)),
+                        "download": str(rnd.getrandbits(32)),
+                    }
+                },
+                "maxsize": str(rnd.getrandbits(32)),
+            }
+            for i in range(depots)
+        },
+    }
+
+    if localized:
+        info["common"]["name_localized"] = {
+            "schinese": "示例游戏",
+            "japanese": "ゲーム",
+        }
+
+    return {str(app_id): info}
+
+
+def measure(func, number=20):
+    """
+    Return the average duration of func in milliseconds.
+    """
+
+    return timeit.timeit(func, number=number) / number * 1000
+
+
+def main():
+    print("backend: " + utils.serializer.backend())
+
+    payloads = {
+        "small": generate_app(10, 5),
+        "large": generate_app(730, 2000),
+        "large-localized": generate_app(570, 2000, localized=True),
+    }
+
+    for name, payload in payloads.items():
+        compact = json.dumps(payload, sort_keys=True).encode("utf-8")
+        pretty = json.dumps(payload, sort_keys=True, indent=4).encode("utf-8")
+
+        # the serializer must never change the output
+        assert utils.serializer.dumps(payload) == compact
+        assert utils.serializer.dumps(payload, pretty=True) == pretty
+        assert utils.serializer.loads(compact) == payload
+
+        results = {
+            "dumps": (
+                measure(lambda: json.dumps(payload, sort_keys=True)),
+                measure(lambda: utils.serializer.dumps(payload)),
+            ),
+            "dumps pretty": (
+                measure(lambda: json.dumps(payload, sort_keys=True, indent=4)),
+                measure(lambda: utils.serializer.dumps(payload, pretty=True)),
+            ),
+            "loads": (
+                measure(lambda: json.loads(compact)),
+                measure(lambda: utils.serializer.loads(compact)),
+            ),
+        }
+
+        print("\n" + name + " (" + str(len(compact) // 1024) + " KiB)")
+        for operation, (stdlib, serializer) in results.items():
+            print(
+                "  {:<13} json {:8.2f} ms  serializer {:8.2f} ms  {:5.2f}x".format(
+                    operation, stdlib, serializer, stdlib / serializer
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -13,27 +13,70 @@ load_dotenv()
 cache = utils.helper.read_env("CACHE", "False", choices=[ "True", "False" ])
 cache_type = utils.helper.read_env("CACHE_TYPE", "redis", choices=[ "redis" ])
 cache_expiration = utils.helper.read_env("CACHE_EXPIRATION", "120")
+cache_stale_expiration = utils.helper.read_env("CACHE_STALE_EXPIRATION", "0")
+cache_compression = utils.helper.read_env("CACHE_COMPRESSION", "True", choices=[ "True", "False" ])
+cache_local_size = utils.helper.read_env("CACHE_LOCAL_SIZE", "1000")
+cache_local_expiration = utils.helper.read_env("CACHE_LOCAL_EXPIRATION", "10")
+cache_lock_expiration = utils.helper.read_env("CACHE_LOCK_EXPIRATION", "10")
+cache_lock_wait = utils.helper.read_env("CACHE_LOCK_WAIT", "5")
  
 redis_url = utils.helper.read_env("REDIS_URL")
 redis_host = utils.helper.read_env("REDIS_HOST", "localhost")
 redis_port = utils.helper.read_env("REDIS_PORT", "6379")
 redis_password = utils.helper.read_env("REDIS_PASSWORD")
 redis_database = utils.helper.read_env("REDIS_DATABASE", "0")
+redis_max_connections = utils.helper.read_env("REDIS_MAX_CONNECTIONS", "50")
+redis_socket_timeout = utils.helper.read_env("REDIS_SOCKET_TIMEOUT", "5")
+redis_health_check_interval = utils.helper.read_env("REDIS_HEALTH_CHECK_INTERVAL", "30")
 
+steam_pool_size = utils.helper.read_env("STEAM_POOL_SIZE", "2")
+steam_pool_keepalive = utils.helper.read_env("STEAM_POOL_KEEPALIVE", "30")
+steam_rate_limit = utils.helper.read_env("STEAM_RATE_LIMIT", "0")
+steam_rate_burst = utils.helper.read_env("STEAM_RATE_BURST", "40")
+steam_rate_reserve = utils.helper.read_env("STEAM_RATE_RESERVE", "10")
+steam_rate_wait = utils.helper.read_env("STEAM_RATE_WAIT", "10")
+steam_circuit_failures = utils.helper.read_env("STEAM_CIRCUIT_FAILURES", "5")
+steam_circuit_timeout = utils.helper.read_env("STEAM_CIRCUIT_TIMEOUT", "30")
+steam_circuit_retries = utils.helper.read_env("STEAM_CIRCUIT_RETRIES", "20")
+
+storage = utils.helper.read_env("STORAGE", "False", choices=[ "True", "False" ])
 storage_type = utils.helper.read_env("STORAGE_TYPE", "local", choices=[ "local", "object" ])
 storage_directory = utils.helper.read_env("STORAGE_DIRECTORY", "data/", dependency={ "STORAGE_TYPE": "local" })
+storage_layout = utils.helper.read_env("STORAGE_LAYOUT", "flat", choices=[ "flat", "sharded" ])
+storage_compression = utils.helper.read_env("STORAGE_COMPRESSION", "none", choices=[ "none", "gzip", "zstd" ])
+storage_fsync = utils.helper.read_env("STORAGE_FSYNC", "False", choices=[ "True", "False" ])
 storage_object_endpoint = utils.helper.read_env("STORAGE_OBJECT_ENDPOINT", dependency={ "STORAGE_TYPE": "object" })
 storage_object_access_key = utils.helper.read_env("STORAGE_OBJECT_ACCESS_KEY", dependency={ "STORAGE_TYPE": "object" })
 storage_object_secret_key = utils.helper.read_env("STORAGE_OBJECT_SECRET_KEY", dependency={ "STORAGE_TYPE": "object" })
 storage_object_bucket = utils.helper.read_env("STORAGE_OBJECT_BUCKET", dependency={ "STORAGE_TYPE": "object" })
 storage_object_secure = utils.helper.read_env("STORAGE_OBJECT_SECURE", True)
 storage_object_region = utils.helper.read_env("STORAGE_OBJECT_REGION", False)
+storage_object_timeout = utils.helper.read_env("STORAGE_OBJECT_TIMEOUT", "10")
+storage_workers = utils.helper.read_env("STORAGE_WORKERS", "16")
+
+listener = utils.helper.read_env("LISTENER", "False", choices=[ "True", "False" ])
+listener_interval_min = utils.helper.read_env("LISTENER_INTERVAL_MIN", "1")
+listener_interval_max = utils.helper.read_env("LISTENER_INTERVAL_MAX", "5")
+
+json_backend = utils.helper.read_env("JSON_BACKEND", "orjson", choices=[ "orjson", "json" ])
 
 log_level = utils.helper.read_env("LOG_LEVEL", "info", choices=[ "debug", "info", "warning", "error", "critical" ])
 version = utils.helper.read_env("VERSION", "9.9.9")
 
 # Set general settings
 chunk_size = 10
+chunk_size_min = utils.helper.read_env("CHUNK_SIZE_MIN", "5")
+chunk_size_max = utils.helper.read_env("CHUNK_SIZE_MAX", "100")
+chunk_target_duration = utils.helper.read_env("CHUNK_TARGET_DURATION", "2")
+chunk_target_size = utils.helper.read_env("CHUNK_TARGET_SIZE", "5000000")
+incorrect_apps_backoff = utils.helper.read_env("INCORRECT_APPS_BACKOFF", "1800")
+incorrect_apps_backoff_max = utils.helper.read_env("INCORRECT_APPS_BACKOFF_MAX", "86400")
+missing_apps_limit = utils.helper.read_env("MISSING_APPS_LIMIT", "10000")
+missing_apps_rate = utils.helper.read_env("MISSING_APPS_RATE", "10")
+missing_apps_batch_size = utils.helper.read_env("MISSING_APPS_BATCH_SIZE", "10000")
+batch_size = utils.helper.read_env("BATCH_SIZE", "100")
+change_log_size = utils.helper.read_env("CHANGE_LOG_SIZE", "10000")
+stream_queue_size = utils.helper.read_env("STREAM_QUEUE_SIZE", "100")
 
 # Logging configuration
 formatter = Logfmter(keys=["level"], mapping={"level": "levelname"})
@@ -50,10 +93,10 @@ beat_schedule = {
         "task": "check_changelist",
         "schedule": 5.0
     },
-    #"check-missing-apps-every-30-minutes": {
-    #    "task": "check_missing_apps",
-    #    "schedule": 1800.0,
-    #},
+    "check-missing-apps-every-1-hour": {
+        "task": "check_missing_apps",
+        "schedule": 3600.0,
+    },
     "check-incorrect-apps-every-30-minutes": {
         "task": "check_incorrect_apps",
         "schedule": 1800.0,
@@ -65,5 +108,13 @@ beat_schedule = {
 }
 worker_concurrency = 4
 
+# Changes are detected by the listener service instead
+if listener == "True":
+    del beat_schedule["check-changelist-every-5-seconds"]
+
+# Missing apps are only kept when they are stored
+if storage != "True":
+    del beat_schedule["check-missing-apps-every-1-hour"]
+
 # Dynamically import all tasks files
 imports = utils.helper.list_tasks()
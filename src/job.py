@@ -4,6 +4,8 @@ Job Service and background worker.
 
 # import modules
 from celery import Celery
+from celery.signals import worker_process_init
+import utils.steam
 import logging
 
 # set up logging
@@ -14,3 +16,13 @@ logger = logging.getLogger(__name__)
 app = Celery()
 app.config_from_object("config")
 app.autodiscover_tasks(["job.tasks"])
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """
+    Log in the Steam sessions as soon as a
+    worker process has been started.
+    """
+
+    utils.steam.start_sessions()
@@ -0,0 +1,94 @@
+"""
+Listener Service that detects app and package changes.
+"""
+
+# import modules
+import logging
+import time
+
+import config
+import utils.cache
+import utils.redis
+import utils.steam
+from tasks.check_changelist import dispatch_changes
+
+logger = logging.getLogger(__name__)
+
+
+def poll(interval):
+    """
+    Check for changes since the last change number with the
+    logged in Steam session, dispatch them and return the
+    interval to wait before polling again and whether the
+    check succeeded.
+    """
+
+    previous_change_number = utils.redis.read("_state.change_number")
+
+    if not previous_change_number:
+        logger.warning("Previous changenumber could not be retrieved from Redis")
+        latest_change_number = utils.steam.get_change_number()
+
+        if latest_change_number:
+            utils.redis.write("_state.change_number", latest_change_number)
+
+        return float(config.listener_interval_max), bool(latest_change_number)
+
+    changes = utils.steam.get_changes_since_change_number(previous_change_number)
+
+    if not changes:
+        return float(config.listener_interval_max), False
+
+    if changes["change_number"] == int(previous_change_number):
+        logger.debug(
+            "The previous and current change number "
+            + str(previous_change_number)
+            + " are the same"
+        )
+        # back off while nothing changes
+        return min(interval * 1.5, float(config.listener_interval_max)), True
+
+    logger.info(
+        "The changenumber has been updated from "
+        + str(previous_change_number)
+        + " to "
+        + str(changes["change_number"])
+    )
+    dispatch_changes(previous_change_number, changes["change_number"], changes)
+
+    # changes tend to come in bursts
+    return float(config.listener_interval_min), True
+
+
+def main():
+    """
+    Keep a logged in Steam session and poll it
+    for changes until stopped.
+    """
+
+    utils.steam.start_sessions(1)
+    interval = float(config.listener_interval_min)
+
+    logger.info("Started listening for changes")
+
+    while True:
+        try:
+            interval, success = poll(interval)
+
+            # tell the job service to stop checking for changes itself
+            if success:
+                utils.redis.write(
+                    utils.cache.LISTENER,
+                    1,
+                    expiration=int(float(config.listener_interval_max) * 3) + 1,
+                )
+
+        except Exception as err:
+            logger.error("Failed to check for changes with error: " + str(err))
+            interval = float(config.listener_interval_max)
+
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()
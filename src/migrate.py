@@ -0,0 +1,142 @@
+"""
+Migration command that moves local storage files to
+the configured layout and compression.
+"""
+
+# import modules
+import argparse
+import logging
+import os
+import time
+
+import config
+import utils.helper
+import utils.storage
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationError(Exception):
+    """
+    Raised when a file could not be migrated.
+    """
+
+
+def migrate_file(path, name):
+    """
+    Rewrite a stored file to its location and compression in
+    the configured layout and remove it from its old location.
+    Returns the changed directories, which are empty when the
+    file was already migrated.
+    """
+
+    directory = utils.helper.combine_paths(config.storage_directory, path)
+    old_file = utils.helper.normalize_directory(directory) + name
+    filename = name.split("/")[-1]
+    new_file = utils.storage.local_file(path, filename)
+
+    with open(old_file, "rb") as f:
+        data = f.read()
+
+    if old_file == new_file and (
+        utils.storage.compression(data) == utils.storage.compression()
+    ):
+        return set()
+
+    content = utils.storage.decompress(data).decode("utf-8")
+
+    if not utils.storage.local_write(content, path, filename, sync_directory=False):
+        raise MigrationError("Failed to write the following file: " + new_file)
+
+    if old_file != new_file:
+        os.remove(old_file)
+
+    return {os.path.dirname(old_file), os.path.dirname(new_file)}
+
+
+def migrate(path, batch_size):
+    """
+    Migrate all files in specified local directory in
+    parallel batches and return the number of migrated
+    and unchanged files.
+    """
+
+    started = time.monotonic()
+    migrated = 0
+    unchanged = 0
+
+    # list first, the migration moves files between the listed directories
+    names = [*utils.storage.local_list(path, recursive=True)]
+
+    for i in range(0, len(names), batch_size):
+        batch = names[i : i + batch_size]
+
+        changes = [
+            *utils.storage.executor().map(lambda name: migrate_file(path, name), batch)
+        ]
+        directories = set().union(*changes)
+
+        if config.storage_fsync == "True":
+            utils.storage.local_sync(directories)
+
+        unchanged += changes.count(set())
+        migrated += len(batch) - changes.count(set())
+
+        logger.info(
+            "Migrated "
+            + str(migrated)
+            + " files in "
+            + path
+            + " at "
+            + str(
+                round((migrated + unchanged) / max(time.monotonic() - started, 0.001))
+            )
+            + " files per second",
+            extra={"unchanged": unchanged},
+        )
+
+    # remove the emptied shards when moving back to the flat layout
+    directory = os.path.dirname(utils.storage.local_file(path, ""))
+    if config.storage_layout == "flat" and os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if entry.is_dir() and len(entry.name) == 2:
+                try:
+                    os.rmdir(entry.path)
+                except OSError:
+                    pass
+
+    return migrated, unchanged
+
+
+def main():
+    """
+    Parse the arguments and migrate the
+    files of the selected directories.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Move local storage files to the configured layout and compression."
+    )
+    parser.add_argument("paths", nargs="*", default=["app/", "package/"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if config.storage_type != "local":
+        parser.error("only local storage can be migrated")
+
+    for path in args.paths:
+        migrated, unchanged = migrate(path, args.batch_size)
+
+        logger.info(
+            "Finished migration of "
+            + path
+            + " with "
+            + str(migrated)
+            + " migrated and "
+            + str(unchanged)
+            + " unchanged files"
+        )
+
+
+if __name__ == "__main__":
+    main()
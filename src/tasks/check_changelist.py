@@ -1,8 +1,11 @@
 from job import app
 from celery_singleton import Singleton
-from .get_app_info import get_app_info_task
+from .get_app_info import get_app_info_task, chunk_size
+from .get_package_info import get_package_info_task
 import utils.steam
 import utils.redis
+import utils.cache
+import utils.serializer
 import logging
 import config
 import time
@@ -15,6 +18,11 @@ def check_changelist_task():
     and start tasks to retrieve these changes.
     """
 
+    # changes are detected by the running listener service instead
+    if utils.redis.read(utils.cache.LISTENER):
+        logging.debug("Skipped checking for changes while the listener is active")
+        return
+
     previous_change_number = utils.redis.read("_state.change_number")
     latest_change_number = utils.steam.get_change_number()
 
@@ -52,10 +60,46 @@ def check_changelist_task():
             )
             time.sleep(1)
 
-        for i in range(0, len(changes["apps"]), config.chunk_size):
-            chunk = changes["apps"][i : i + config.chunk_size]
-            get_app_info_task.delay(chunk)
+        dispatch_changes(previous_change_number, latest_change_number, changes)
 
-        utils.redis.write("_state.change_number", latest_change_number)
-        utils.redis.increment("_state.changed_apps", len(changes["apps"]))
-        utils.redis.increment("_state.changed_packages", len(changes["packages"]))
+
+def dispatch_changes(previous_change_number, latest_change_number, changes):
+    """
+    Start tasks to retrieve the changed apps and packages,
+    log the changes and store the latest change number.
+    """
+
+    utils.cache.invalidate(
+        ["app." + str(app) for app in changes["apps"]]
+        + ["package." + str(package) for package in changes["packages"]]
+    )
+
+    app_chunk_size = chunk_size()
+    for i in range(0, len(changes["apps"]), app_chunk_size):
+        chunk = changes["apps"][i : i + app_chunk_size]
+        get_app_info_task.delay(chunk)
+
+    for i in range(0, len(changes["packages"]), config.chunk_size):
+        chunk = changes["packages"][i : i + config.chunk_size]
+        get_package_info_task.delay(chunk)
+
+    # keep the changes so consumers can request them by change number
+    # and push them to the subscribers of the change stream
+    entry = {
+        "change_number": int(latest_change_number),
+        "previous_change_number": int(previous_change_number),
+        "apps": changes["apps"],
+        "packages": changes["packages"],
+    }
+    content = utils.serializer.dumps(entry)
+    utils.redis.append_log(
+        utils.cache.CHANGE_LOG,
+        int(latest_change_number),
+        content,
+        config.change_log_size,
+    )
+    utils.redis.publish(utils.cache.CHANGES_CHANNEL, content)
+
+    utils.redis.write("_state.change_number", latest_change_number)
+    utils.redis.increment("_state.changed_apps", len(changes["apps"]))
+    utils.redis.increment("_state.changed_packages", len(changes["packages"]))
@@ -1,9 +1,17 @@
 from job import app, logger
 from celery_singleton import Singleton
-from .get_app_info import get_app_info_task
+from .get_app_info import get_app_info_task, chunk_size
+import utils.storage
+import utils.redis
+import utils.cache
 import utils.steam
 import config
 
+# sets of the apps in Steam, the apps already present and the missing apps
+STEAM_APPS = "_state.steam_apps"
+PRESENT_APPS = "_state.present_apps"
+MISSING_APPS = "_state.missing_apps"
+
 
 @app.task(name="check_missing_apps", base=Singleton, lock_expiry=7200)
 def check_missing_apps_task():
@@ -13,22 +21,66 @@ def check_missing_apps_task():
     retrieve the info for the missing apps.
     """
 
-    steam_apps = utils.steam.get_app_list()
+    batch_size = int(config.missing_apps_batch_size)
+    utils.redis.delete(STEAM_APPS, PRESENT_APPS)
+
+    # stream the app list into a set instead of keeping it in memory
+    add_batches(STEAM_APPS, utils.steam.iter_app_list(), batch_size)
+
+    # apps that have been cached before, which is remembered after their
+    # values expire, or that are in the manifest or the retry schedule
+    for key in (utils.cache.VALIDATORS + "app", utils.cache.MANIFEST + "app"):
+        for fields in utils.redis.scan_fields(key, batch_size):
+            utils.redis.add_members(PRESENT_APPS, fields)
+
+    add_batches(
+        PRESENT_APPS,
+        utils.redis.read_schedule(utils.cache.INCORRECT_APPS, "+inf") or [],
+        batch_size,
+    )
+
+    # stored apps are present as well, also when the cache was emptied
+    if config.storage == "True":
+        stored = utils.storage.list("app/", recursive=True)
+        add_batches(
+            PRESENT_APPS,
+            (name.split("/")[-1][:-5] for name in stored if name.endswith(".json")),
+            batch_size,
+        )
+
+    missing = utils.redis.diff_members(MISSING_APPS, STEAM_APPS, PRESENT_APPS)
+    utils.redis.delete(STEAM_APPS, PRESENT_APPS)
 
-    stored_apps = utils.storage.list("app/")
-    stored_apps_list = []
-    for app_obj in stored_apps:
-        app_id = app_obj.split(".")[0]
-        app_ext = app_obj.split(".")[1]
-        if app_ext == "json":
-            stored_apps_list.append(int(app_id))
+    if not missing:
+        return
 
-    diff = utils.helper.list_differences(steam_apps, stored_apps_list)
-    if len(diff) > 0:
-        logger.info(
-            "Compared stored apps and found " + str(len(diff)) + " missing apps"
+    logger.info("Compared stored apps and found " + str(missing) + " missing apps")
+
+    # retrieve a limited number of apps per run, the rest follows next run
+    popped = utils.redis.pop_members(MISSING_APPS, int(config.missing_apps_limit))
+    diff = [int(app_id) for app_id in popped or []]
+    utils.redis.delete(MISSING_APPS)
+
+    # spread the chunks over time to stay below the rate
+    app_chunk_size = chunk_size()
+    for i in range(0, len(diff), app_chunk_size):
+        chunk = diff[i : i + app_chunk_size]
+        get_app_info_task.apply_async(
+            (chunk,), countdown=i / float(config.missing_apps_rate)
         )
 
-    for i in range(0, len(diff), config.chunk_size):
-        chunk = diff[i : i + config.chunk_size]
-        get_app_info_task.delay(chunk)
+
+def add_batches(key, members, batch_size):
+    """
+    Add the members of an iterable to the set of
+    specified key in batches of batch_size.
+    """
+
+    batch = []
+    for member in members:
+        batch.append(member)
+        if len(batch) == batch_size:
+            utils.redis.add_members(key, batch)
+            batch = []
+
+    utils.redis.add_members(key, batch)
@@ -1,25 +1,118 @@
 from job import app, logger
 import utils.storage
+import utils.redis
 import utils.steam
-import json
+import utils.cache
+import config
+import time
 
 
 @app.task(
     name="get_app_info",
-    time_limit=15,
+    bind=True,
+    time_limit=60,
     autoretry_for=(Exception,),
     retry_kwargs={"max_retries": 3, "countdown": 5},
 )
-def get_app_info_task(apps=[]):
+def get_app_info_task(self, apps=[]):
     """
     Get app information of input list of apps, generate
     separate json files and upload them to the store.
     """
 
     logger.info("Getting product info for following apps: " + str(apps))
-    apps = utils.steam.get_apps_info(apps)
 
+    requested = apps
+
+    started = time.monotonic()
+
+    try:
+        apps = utils.steam.get_apps_info(apps, raise_errors=True)
+
+    except utils.steam.Unavailable as err:
+        # the request was never sent, so the chunk size is not to blame
+        logger.warning("Deferring app info retrieval because Steam is unavailable")
+        raise self.retry(
+            exc=err,
+            countdown=int(config.steam_circuit_timeout),
+            max_retries=int(config.steam_circuit_retries),
+        )
+
+    except Exception:
+        # smaller chunks are less likely to time out or exceed the size limit
+        write_chunk_size(chunk_size() // 2)
+        raise
+
+    duration = time.monotonic() - started
+
+    data = {}
+    stored = []
+    size = 0
     for app_obj in apps:
-        content = {app_obj: apps[app_obj]}
-        content = json.dumps(content)
-        utils.redis.write("app." + str(app_obj), content)
+        content = utils.cache.encode("app", app_obj, {app_obj: apps[app_obj]})
+        value = content["app." + str(app_obj)]
+        size += len(value)
+        data.update(content)
+        stored.append((app_obj, value, apps[app_obj].get("_change_number", 0)))
+
+    utils.cache.write("app", data)
+    utils.cache.persist("app", stored)
+    utils.cache.invalidate(["app." + str(app_obj) for app_obj in apps])
+    utils.redis.unschedule(
+        utils.cache.INCORRECT_APPS, [str(app_obj) for app_obj in apps]
+    )
+
+    # apps missing from the response are retried by check_incorrect_apps
+    utils.redis.schedule(
+        utils.cache.INCORRECT_APPS,
+        [str(app_obj) for app_obj in set(requested) - set(apps)],
+    )
+
+    adapt_chunk_size(len(requested), duration, size)
+
+
+def chunk_size():
+    """
+    Return the number of apps per get_app_info task,
+    adapted to the duration and payload size of the
+    previous tasks.
+    """
+
+    size = utils.redis.read("_state.chunk_size")
+
+    if not size:
+        return config.chunk_size
+
+    return min(max(int(size), int(config.chunk_size_min)), int(config.chunk_size_max))
+
+
+def write_chunk_size(size):
+    """
+    Store the number of apps per get_app_info task
+    within the configured bounds.
+    """
+
+    size = min(max(int(size), int(config.chunk_size_min)), int(config.chunk_size_max))
+    utils.redis.write("_state.chunk_size", size)
+
+
+def adapt_chunk_size(count, duration, size):
+    """
+    Move the chunk size halfway towards the number of apps
+    that fit in the target duration and payload size, based
+    on a chunk of count apps that took duration seconds and
+    size bytes.
+    """
+
+    if not count:
+        return
+
+    targets = [int(config.chunk_size_max)]
+
+    if duration > 0:
+        targets.append(float(config.chunk_target_duration) / (duration / count))
+
+    if size > 0:
+        targets.append(int(config.chunk_target_size) / (size / count))
+
+    write_chunk_size(round((chunk_size() + min(targets)) / 2))
@@ -1,24 +1,54 @@
 from job import app, logger
 import utils.storage
+import utils.redis
 import utils.steam
-import json
+import utils.cache
+import config
 
 
 @app.task(
     name="get_package_info",
-    time_limit=3,
+    bind=True,
+    time_limit=15,
     autoretry_for=(Exception,),
     retry_kwargs={"max_retries": 3, "countdown": 5},
 )
-def get_package_info_task(packages=[]):
+def get_package_info_task(self, packages=[]):
     """
     Get package information of input list of packages, generate
     separate json files and upload them to the store.
     """
 
     logger.info("Getting product info for following packages: " + str(packages))
-    packages = utils.steam.get_packages_info(packages)
 
+    try:
+        packages = utils.steam.get_packages_info(packages, raise_errors=True)
+
+    # retry later instead of failing while Steam is unavailable
+    except utils.steam.Unavailable as err:
+        logger.warning("Deferring package info retrieval because Steam is unavailable")
+        raise self.retry(
+            exc=err,
+            countdown=int(config.steam_circuit_timeout),
+            max_retries=int(config.steam_circuit_retries),
+        )
+
+    data = {}
+    stored = []
     for package_obj in packages:
-        content = json.dumps(packages[package_obj])
-        utils.redis.write("package." + str(package_obj), content)
+        content = utils.cache.encode(
+            "package", package_obj, {package_obj: packages[package_obj]}
+        )
+        data.update(content)
+        stored.append(
+            (
+                package_obj,
+                content["package." + str(package_obj)],
+                packages[package_obj].get("_change_number", 0),
+            )
+        )
+
+    utils.cache.write("package", data)
+    utils.cache.persist("package", stored)
+
+    utils.cache.invalidate(["package." + str(package_obj) for package_obj in packages])
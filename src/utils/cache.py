@@ -0,0 +1,745 @@
+import asyncio
+import config
+import gzip
+import hashlib
+import logging
+import re
+import time
+import utils.redis
+import utils.serializer
+import utils.steam
+import utils.storage
+from collections import OrderedDict
+
+# channel of cache keys that have been changed or rewritten
+INVALIDATE_CHANNEL = "_events.invalidate"
+
+# channel of changed apps and packages by change number
+CHANGES_CHANNEL = "_events.changes"
+
+# sorted set of changed apps and packages by change number
+CHANGE_LOG = "_state.change_log"
+
+# set while a listener service is detecting changes
+LISTENER = "_state.listener"
+
+# retry schedule of apps that failed to be fetched
+INCORRECT_APPS = "_state.incorrect_apps"
+
+# hashes of the ids, content hashes and change numbers in storage
+MANIFEST = "_manifest."
+
+# hashes of the ids and metadata of the latest values, kept after
+# the values expire so unchanged values keep their modification time
+VALIDATORS = "_validators."
+
+# change number in the canonical JSON of app or package info
+CHANGE_NUMBER_PATTERN = re.compile(rb'"_change_number":\s*(\d+)')
+
+# running info fetches and refreshes of the current process
+_fetches = {}
+_refreshes = {}
+
+# response bodies smaller than this are not worth compressing
+COMPRESSION_MIN_SIZE = 1024
+
+# in-process cache of hot keys and its counters
+_local = OrderedDict()
+local_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+# queues of the change stream subscribers of the current process
+_subscribers = set()
+
+
+## encoding functions
+
+
+def cache_keys(kind, item_id):
+    """
+    Return the cache keys of an app or package: the
+    value, the compressed response body and the metadata.
+    """
+
+    key = kind + "." + str(item_id)
+
+    return [key, key + ".gz", key + ".meta"]
+
+
+def encode(kind, item_id, info):
+    """
+    Encode app or package info to the values stored in the
+    cache: the canonical JSON of the info, the gzip compressed
+    response body when enabled and the metadata with the
+    ETag and modification time.
+    """
+
+    # str keys keep the output equal while allowing the fast serializer
+    if info:
+        info = {str(item): info[item] for item in info}
+
+    return encode_value(kind, item_id, utils.serializer.dumps(info))
+
+
+def encode_value(kind, item_id, value, modified=None):
+    """
+    Encode the canonical JSON of app or package info
+    to the values stored in the cache, modified now
+    unless the modification timestamp is given.
+    """
+
+    key, compressed_key, meta_key = cache_keys(kind, item_id)
+
+    # an empty value overwrites the compressed body of a previous value
+    data = {key: value, compressed_key: b""}
+
+    if config.cache_compression == "True":
+        body = response_body({item_id: value})
+        if len(body) >= COMPRESSION_MIN_SIZE:
+            data[compressed_key] = gzip.compress(body)
+
+    etag = 'W/"' + digest(value) + '"'
+    modified = int(time.time()) if modified is None else modified
+    data[meta_key] = (etag + " " + str(modified)).encode("utf-8")
+
+    return data
+
+
+def digest(value):
+    """
+    Return the short content hash of a cached value.
+    """
+
+    return hashlib.blake2b(value, digest_size=8).hexdigest()
+
+
+def cache_entry(kind, item_id, data):
+    """
+    Return the value, compressed response body and metadata
+    of an app or package from a dict of cache keys and values.
+    """
+
+    return tuple(data.get(key) or False for key in cache_keys(kind, item_id))
+
+
+def parse_meta(meta):
+    """
+    Return the ETag and modification timestamp from the
+    metadata of an app, or None for both if not available.
+    """
+
+    if not meta:
+        return None, None
+
+    etag, _, modified = meta.decode("utf-8").partition(" ")
+
+    return etag, int(modified)
+
+
+def item_data(item_id, value):
+    """
+    Return the JSON of the data of an app or package from
+    its cached value, which has the form {"<id>": <data>},
+    or an empty object for items without data.
+    """
+
+    prefix = b'{"' + str(item_id).encode("utf-8") + b'": '
+
+    if value and value.startswith(prefix) and value.endswith(b"}"):
+        return value[len(prefix) : -1]
+
+    # packages were cached as their bare data before they got the app format
+    if value and value.startswith(b"{"):
+        return value
+
+    return b"{}"
+
+
+def response_body(items, status="success"):
+    """
+    Build the compact response body of a dict of ids and
+    cached values without parsing them. The output is equal
+    to json.dumps of the response with sorted keys.
+    """
+
+    data = b", ".join(
+        b'"'
+        + str(item_id).encode("utf-8")
+        + b'": '
+        + item_data(item_id, items[item_id])
+        for item_id in sorted(items, key=int)
+    )
+
+    return b'{"data": {' + data + b'}, "status": "' + status.encode("utf-8") + b'"}'
+
+
+## local cache functions
+
+
+def local_read(key):
+    """
+    Read specified key from the in-process cache and
+    return None if not found or expired.
+    """
+
+    entry = _local.get(key)
+
+    if entry and entry[1] > time.monotonic():
+        _local.move_to_end(key)
+        local_stats["hits"] += 1
+        return entry[0]
+
+    if entry:
+        del _local[key]
+
+    local_stats["misses"] += 1
+    return None
+
+
+def local_write(key, value):
+    """
+    Write specified key to the in-process cache and
+    evict the least recently used keys when full.
+    """
+
+    size = int(config.cache_local_size)
+    if size == 0:
+        return
+
+    expires = time.monotonic() + float(config.cache_local_expiration)
+    _local[key] = (value, expires)
+    _local.move_to_end(key)
+
+    while len(_local) > size:
+        _local.popitem(last=False)
+        local_stats["evictions"] += 1
+
+
+def local_delete(keys):
+    """
+    Remove specified keys from the in-process cache.
+    """
+
+    for key in keys:
+        if _local.pop(key, None):
+            local_stats["invalidations"] += 1
+
+
+def invalidate(keys):
+    """
+    Notify all workers that the specified keys have
+    been changed so they drop them from their
+    in-process cache.
+    """
+
+    if keys:
+        utils.redis.publish(INVALIDATE_CHANNEL, utils.serializer.dumps(keys))
+
+
+async def async_invalidate(keys):
+    """
+    Notify all workers that the specified keys have
+    been changed without blocking the event loop.
+    """
+
+    if keys:
+        await utils.redis.async_publish(
+            INVALIDATE_CHANNEL, utils.serializer.dumps(keys)
+        )
+
+
+async def listen(stats_interval=60):
+    """
+    Subscribe to invalidations and changes, remove invalidated
+    keys from the in-process cache and pass changes to the
+    stream subscribers. Reconnects when the connection to
+    Redis is lost and logs the cache counters every stats
+    interval.
+    """
+
+    while True:
+        pubsub = utils.redis.async_connect().pubsub()
+
+        try:
+            await pubsub.subscribe(INVALIDATE_CHANNEL, CHANGES_CHANNEL)
+            logged = time.monotonic()
+
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=stats_interval
+                )
+
+                if message and message["channel"] == CHANGES_CHANNEL.encode():
+                    dispatch(utils.serializer.loads(message["data"]))
+                elif message:
+                    local_delete(utils.serializer.loads(message["data"]))
+
+                if time.monotonic() - logged >= stats_interval:
+                    logging.info("Local cache statistics", extra=dict(local_stats))
+                    logged = time.monotonic()
+
+        except Exception as err:
+            logging.error(
+                "Lost subscription to cache invalidations with error: " + str(err)
+            )
+            # the cache can't be trusted while invalidations are missed
+            _local.clear()
+            # subscribers have to catch up on missed changes themselves
+            for queue in list(_subscribers):
+                disconnect(queue)
+            await asyncio.sleep(1)
+
+        finally:
+            await pubsub.aclose()
+
+
+## change stream functions
+
+
+def subscribe():
+    """
+    Register a change stream subscriber and return its
+    queue of changes. A None item marks the end of the
+    stream.
+    """
+
+    queue = asyncio.Queue(maxsize=int(config.stream_queue_size))
+    _subscribers.add(queue)
+
+    return queue
+
+
+def unsubscribe(queue):
+    """
+    Remove a change stream subscriber.
+    """
+
+    _subscribers.discard(queue)
+
+
+def disconnect(queue):
+    """
+    Drop the pending changes of a subscriber and end
+    its stream.
+    """
+
+    unsubscribe(queue)
+
+    while not queue.empty():
+        queue.get_nowait()
+
+    queue.put_nowait(None)
+
+
+def dispatch(change):
+    """
+    Pass a change to all stream subscribers. Subscribers
+    that don't keep up are disconnected instead of
+    buffering changes without bounds.
+    """
+
+    for queue in list(_subscribers):
+        try:
+            queue.put_nowait(change)
+
+        except asyncio.QueueFull:
+            logging.warning("Disconnected change stream subscriber that lags behind")
+            disconnect(queue)
+
+
+## write functions
+
+
+def write(kind, data, expiration=None):
+    """
+    Write a dict of cache keys and values of apps or packages
+    to the cache, keeping the modification time of values
+    that have not changed. See utils.redis.write_many for
+    the expiration.
+    """
+
+    previous = utils.redis.read_fields(VALIDATORS + kind, meta_ids(kind, data))
+
+    if previous is not False:
+        keep_modified(kind, data, previous)
+
+    if not utils.redis.write_many(data, expiration):
+        return False
+
+    return utils.redis.write_fields(VALIDATORS + kind, validators(kind, data))
+
+
+async def async_write(kind, data):
+    """
+    Write a dict of cache keys and values of apps or packages
+    to the cache without blocking the event loop, keeping the
+    modification time of values that have not changed.
+    """
+
+    previous = await utils.redis.async_read_fields(
+        VALIDATORS + kind, meta_ids(kind, data)
+    )
+
+    if previous is not False:
+        keep_modified(kind, data, previous)
+
+    if not await utils.redis.async_write_many(data):
+        return False
+
+    return await utils.redis.async_write_fields(
+        VALIDATORS + kind, validators(kind, data)
+    )
+
+
+def meta_ids(kind, data):
+    """
+    Return the ids of the apps or packages with metadata
+    in a dict of cache keys and values.
+    """
+
+    prefix = kind + "."
+
+    return [key[len(prefix) : -5] for key in data if key.endswith(".meta")]
+
+
+def keep_modified(kind, data, previous):
+    """
+    Replace the metadata in a dict of cache keys and values
+    by the previous metadata of the same id, from a list in
+    the order of the ids, when the ETag is unchanged. The
+    dict is changed in place.
+    """
+
+    for item_id, meta in zip(meta_ids(kind, data), previous, strict=True):
+        key = kind + "." + item_id + ".meta"
+
+        if meta and meta.split(" ")[0] == data[key].decode("utf-8").split(" ")[0]:
+            data[key] = meta.encode("utf-8")
+
+
+def validators(kind, data):
+    """
+    Return a dict of the ids and metadata of the apps or
+    packages in a dict of cache keys and values.
+    """
+
+    return {
+        item_id: data[kind + "." + item_id + ".meta"].decode("utf-8")
+        for item_id in meta_ids(kind, data)
+    }
+
+
+## fetch functions
+
+
+async def get_info(kind, item_ids, background=False, raise_errors=False):
+    """
+    Get app or package info of list of ids from
+    Steam without blocking the event loop.
+    """
+
+    if kind == "package":
+        return await utils.steam.async_get_packages_info(
+            item_ids, background, raise_errors
+        )
+
+    return await utils.steam.async_get_apps_info(item_ids, background, raise_errors)
+
+
+async def fetch(kind, item_id):
+    """
+    Fetch app or package info from Steam, write it to the
+    cache and return its cache entry. Concurrent callers
+    for the same item share one fetch.
+    """
+
+    key = kind + "." + str(item_id)
+    running = _fetches.get(key)
+
+    if not running:
+        running = asyncio.ensure_future(_fetch(kind, item_id))
+        running.add_done_callback(lambda _: _fetches.pop(key, None))
+        _fetches[key] = running
+
+    # cancelled requests must not cancel the fetch of other waiters
+    return await asyncio.shield(running)
+
+
+async def _fetch(kind, item_id):
+    """
+    Fetch app or package info from storage or Steam while
+    holding its fetch lock, or wait for the worker holding
+    the lock to fill the cache. Returns the cache entry.
+    """
+
+    key = kind + "." + str(item_id)
+
+    if config.cache != "True":
+        info = await get_info(kind, [item_id])
+        return cache_entry(kind, item_id, encode(kind, item_id, info))
+
+    lock = "lock." + key
+    token = await utils.redis.async_lock(lock, config.cache_lock_expiration)
+
+    if token is False:
+        entry = await _wait_for(kind, item_id)
+        if entry:
+            return entry
+
+        logging.warning(
+            "Timed out waiting for " + kind + " info fetch of other worker",
+            extra={kind + "s": str([item_id])},
+        )
+
+    try:
+        stored = await load(kind, [item_id])
+
+        if item_id in stored:
+            data = encode_value(kind, item_id, *stored[item_id])
+
+        else:
+            try:
+                info = await get_info(kind, [item_id], raise_errors=True)
+
+            # fail fast without caching the failure while Steam is unavailable,
+            # a half-open circuit lets a single caller through as probe
+            except utils.steam.Unavailable:
+                return False, False, False
+
+            except Exception:
+                info = False
+
+            data = encode(kind, item_id, info)
+
+            # the failure is cached as false until the app is retried
+            if info is False and kind == "app":
+                await utils.redis.async_schedule(INCORRECT_APPS, [str(item_id)])
+
+        await async_write(kind, data)
+        await async_invalidate([key])
+
+    finally:
+        if token:
+            await utils.redis.async_unlock(lock, token)
+
+    return cache_entry(kind, item_id, data)
+
+
+async def _wait_for(kind, item_id, interval=0.1):
+    """
+    Poll the cache for the app or package until it has
+    been written or the lock wait time has passed.
+    """
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + float(config.cache_lock_wait)
+
+    while loop.time() < deadline:
+        await asyncio.sleep(interval)
+
+        values, _ = await utils.redis.async_read_with_ttl(cache_keys(kind, item_id))
+        if values[0]:
+            return tuple(values)
+
+    return False
+
+
+def refresh(kind, item_id):
+    """
+    Start refreshing stale app or package info in the
+    background unless it is already being refreshed.
+    """
+
+    key = kind + "." + str(item_id)
+
+    if key in _refreshes:
+        return
+
+    running = asyncio.ensure_future(_refresh(kind, item_id))
+    running.add_done_callback(lambda _: _refreshes.pop(key, None))
+    _refreshes[key] = running
+
+
+async def _refresh(kind, item_id):
+    """
+    Fetch app or package info from Steam and overwrite the
+    stale value in the cache, unless another worker already
+    holds its fetch lock.
+    """
+
+    key = kind + "." + str(item_id)
+    lock = "lock." + key
+    token = await utils.redis.async_lock(lock, config.cache_lock_expiration)
+
+    if not token:
+        return
+
+    try:
+        logging.info(
+            "Refreshing stale " + kind + " info", extra={kind + "s": str([item_id])}
+        )
+        info = await get_info(kind, [item_id], background=True)
+
+        # keep serving the stale value when the refresh failed
+        if info is not False:
+            await async_write(kind, encode(kind, item_id, info))
+            await async_invalidate([key])
+
+    finally:
+        await utils.redis.async_unlock(lock, token)
+
+
+async def fetch_many(kind, item_ids):
+    """
+    Fetch info of multiple apps or packages from storage or
+    Steam with a single request, write every item to the
+    cache and return a dict of ids and cached values.
+    """
+
+    stored = await load(kind, item_ids)
+    missing = [item_id for item_id in item_ids if item_id not in stored]
+
+    info = await get_info(kind, missing) if missing else {}
+
+    if info is False:
+        return False
+
+    values = {}
+    data = {}
+    for item_id in item_ids:
+        if item_id in stored:
+            item = encode_value(kind, item_id, *stored[item_id])
+        elif item_id in info:
+            item = encode(kind, item_id, {item_id: info[item_id]})
+        else:
+            item = encode(kind, item_id, {})
+
+        values[item_id] = item[kind + "." + str(item_id)]
+        data.update(item)
+
+    if config.cache == "True":
+        await async_write(kind, data)
+        await async_invalidate([kind + "." + str(item_id) for item_id in values])
+
+    return values
+
+
+## storage functions
+
+
+def persist(kind, items):
+    """
+    Write the cached values of a list of (id, value, change
+    number) tuples of apps or packages to storage, skipping
+    values that are unchanged according to the manifest. The
+    manifest keeps the content hash, change number and time
+    of modification of every stored value.
+    """
+
+    if config.storage != "True" or not items:
+        return
+
+    manifest = utils.redis.read_fields(
+        MANIFEST + kind, [str(item_id) for item_id, _, _ in items]
+    )
+
+    # without the manifest nothing is known to be unchanged
+    if manifest is False:
+        logging.warning(
+            "Failed to read the storage manifest, writing all " + kind + "s",
+            extra={kind + "s": str([item_id for item_id, _, _ in items])},
+        )
+        manifest = [False] * len(items)
+
+    modified = str(int(time.time()))
+    contents = {}
+    entries = {}
+    for (item_id, value, change_number), entry in zip(items, manifest):
+        content_hash = digest(value)
+
+        if entry and entry.split(":")[0] == content_hash:
+            continue
+
+        contents[str(item_id) + ".json"] = value.decode("utf-8")
+        entries[str(item_id) + ".json"] = ":".join(
+            [content_hash, str(change_number), modified]
+        )
+
+    written = utils.storage.write_many(contents, kind + "/")
+
+    utils.redis.write_fields(
+        MANIFEST + kind,
+        {
+            filename[:-5]: entries[filename]
+            for filename, result in written.items()
+            if result
+        },
+    )
+
+
+async def load(kind, item_ids):
+    """
+    Read the stored values of apps or packages that are in
+    the manifest from storage and return a dict of ids and
+    tuples of the value and its modification timestamp, which
+    is None for entries written without it.
+    """
+
+    if config.storage != "True" or not item_ids:
+        return {}
+
+    manifest = await utils.redis.async_read_fields(
+        MANIFEST + kind, [str(item_id) for item_id in item_ids]
+    )
+
+    # without the manifest nothing is known to be stored
+    if manifest is False:
+        logging.warning(
+            "Failed to read the storage manifest, skipping storage",
+            extra={kind + "s": str(item_ids)},
+        )
+        return {}
+
+    entries = dict(zip(item_ids, manifest))
+    stored = [item_id for item_id in item_ids if entries[item_id]]
+
+    # storage is blocking so read the files in the storage threads
+    loop = asyncio.get_running_loop()
+    contents = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                utils.storage.executor(),
+                utils.storage.read,
+                kind + "/",
+                str(item_id) + ".json",
+            )
+            for item_id in stored
+        )
+    )
+
+    return {
+        item_id: (content.encode("utf-8"), manifest_modified(entries[item_id]))
+        for item_id, content in zip(stored, contents)
+        if content
+    }
+
+
+def change_number(value):
+    """
+    Return the change number of a cached value without
+    parsing it, or 0 when it has none.
+    """
+
+    match = CHANGE_NUMBER_PATTERN.search(value)
+
+    return int(match.group(1)) if match else 0
+
+
+def manifest_modified(entry):
+    """
+    Return the modification timestamp of a manifest
+    entry, or None when it has not been recorded.
+    """
+
+    fields = entry.split(":")
+
+    return int(fields[2]) if len(fields) > 2 else None
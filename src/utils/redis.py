@@ -1,32 +1,222 @@
 import logging
 import config
+import os
 import redis
+import redis.asyncio
+import threading
+import time
+import uuid
+
+# connection pool of the current process
+_pool_lock = threading.Lock()
+_pool_pid = None
+_pool = None
+_async_pool_pid = None
+_async_pool = None
+
+# only delete a lock when it is still held by the same token
+UNLOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# take a token from the bucket unless that would leave less than the
+# reserve, otherwise return the seconds until enough tokens are refilled
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local time = redis.call("time")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("hmget", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens - 1 >= reserve then
+    tokens = tokens - 1
+else
+    wait = (reserve + 1 - tokens) / rate
+end
+redis.call("hset", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("expire", KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+# closed while the failures are below the threshold, open until the
+# timeout has passed and then half-open for a single probe per timeout
+CIRCUIT_ALLOW_SCRIPT = """
+local threshold = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+local failures = tonumber(redis.call("hget", KEYS[1], "failures")) or 0
+if failures < threshold then
+    return 1
+end
+local now = tonumber(redis.call("time")[1])
+local opened = tonumber(redis.call("hget", KEYS[1], "opened")) or 0
+if now - opened < timeout then
+    return 0
+end
+if ARGV[3] == "1" then
+    redis.call("hset", KEYS[1], "opened", now)
+end
+return 1
+"""
+
+# reset the failures on success or count the failure and (re)open
+# the circuit when the threshold has been reached
+CIRCUIT_RECORD_SCRIPT = """
+if ARGV[1] == "1" then
+    if redis.call("exists", KEYS[1]) == 1 then
+        redis.call("del", KEYS[1])
+    end
+    return 0
+end
+local failures = redis.call("hincrby", KEYS[1], "failures", 1)
+if failures >= tonumber(ARGV[2]) then
+    redis.call("hset", KEYS[1], "opened", redis.call("time")[1])
+end
+return failures
+"""
+
+
+def pool_arguments():
+    """
+    Return the connection pool arguments
+    shared by all Redis clients.
+    """
+
+    return {
+        "max_connections": int(config.redis_max_connections),
+        "socket_timeout": float(config.redis_socket_timeout),
+        "socket_connect_timeout": float(config.redis_socket_timeout),
+        "health_check_interval": int(config.redis_health_check_interval),
+        # wait for a free connection instead of failing when the pool is full
+        "timeout": float(config.redis_socket_timeout),
+    }
+
+
+def create_pool(pool_class=redis.BlockingConnectionPool):
+    """
+    Parse redis config and create a connection pool.
+    """
+
+    # try connection string, or default to separate REDIS_* env vars
+    if config.redis_url:
+        return pool_class.from_url(
+            config.redis_url, db=config.redis_database, **pool_arguments()
+        )
+
+    elif config.redis_password:
+        return pool_class(
+            host=config.redis_host,
+            port=config.redis_port,
+            password=config.redis_password,
+            db=config.redis_database,
+            **pool_arguments(),
+        )
+
+    else:
+        return pool_class(
+            host=config.redis_host,
+            port=config.redis_port,
+            db=config.redis_database,
+            **pool_arguments(),
+        )
+
+
+def get_pool():
+    """
+    Return the connection pool of the current process
+    and create a new one after a fork, so gunicorn and
+    Celery workers never share sockets with the parent.
+    """
+
+    global _pool, _pool_pid
+
+    if _pool_pid == os.getpid():
+        return _pool
+
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            _pool = create_pool()
+            _pool_pid = os.getpid()
+
+    return _pool
+
+
+def get_async_pool():
+    """
+    Return the asyncio connection pool of the
+    current process.
+    """
+
+    global _async_pool, _async_pool_pid
+
+    if _async_pool_pid != os.getpid():
+        _async_pool = create_pool(redis.asyncio.BlockingConnectionPool)
+        _async_pool_pid = os.getpid()
+
+    return _async_pool
+
+
+def cache_ttl():
+    """
+    Return the ttl of cached values, which is the
+    expiration plus the time a value may be served
+    stale, or 0 if values never expire.
+    """
+
+    expiration = int(config.cache_expiration)
+
+    if expiration == 0:
+        return 0
+
+    return expiration + int(config.cache_stale_expiration)
+
+
+def is_stale(ttl):
+    """
+    Check if a cached value with the remaining
+    ttl has passed its expiration.
+    """
+
+    if ttl < 0:
+        return False
+
+    return ttl < int(config.cache_stale_expiration)
 
 
 def connect():
     """
-    Parse redis config and connect.
+    Return a Redis client using the shared
+    connection pool.
     """
 
     try:
-        # try connection string, or default to separate REDIS_* env vars
-        if config.redis_url:
-            rds = redis.Redis.from_url(config.redis_url, db=config.redis_database)
+        rds = redis.Redis(connection_pool=get_pool())
+
+    except Exception as error:
+        logging.error("Failed to connect to Redis with error: " + str(error))
+        return False
+
+    return rds
 
-        elif config.redis_password:
-            rds = redis.Redis(
-                host=config.redis_host,
-                port=config.redis_port,
-                password=config.redis_password,
-                db=config.redis_database,
-            )
-        else:
-            rds = redis.Redis(
-                host=config.redis_host, port=config.redis_port, db=config.redis_database
-            )
+
+def async_connect():
+    """
+    Return an asyncio Redis client using the
+    shared asyncio connection pool.
+    """
+
+    try:
+        rds = redis.asyncio.Redis(connection_pool=get_async_pool())
 
     except Exception as error:
-        logging.error("Failed to connect to Redis with error: " + error)
+        logging.error("Failed to connect to Redis with error: " + str(error))
         return False
 
     return rds
@@ -65,16 +255,37 @@ def read(key):
     return False
 
 
-def write(key, data):
+def scan_fields(key, count=1000):
+    """
+    Iterate over the fields of the hash of specified
+    key in batches of about count fields.
+    """
+
+    rds = connect()
+    cursor = 0
+
+    while True:
+        cursor, fields = rds.hscan(key, cursor, count=count)
+
+        if fields:
+            yield [field.decode("UTF-8") for field in fields]
+
+        if cursor == 0:
+            break
+
+
+def write(key, data, expiration=None):
     """
-    Write specified key to Redis.
+    Write specified key to Redis, expiring after the
+    cache ttl unless another expiration is specified.
     """
 
     rds = connect()
 
     # write data and set ttl
     try:
-        expiration = int(config.cache_expiration)
+        if expiration is None:
+            expiration = cache_ttl()
 
         # insert data into Redis
         if expiration == 0:
@@ -97,6 +308,41 @@ def write(key, data):
     return False
 
 
+def write_many(data, expiration=None):
+    """
+    Write dict of keys and values to Redis within a
+    single pipeline, expiring after the cache ttl unless
+    the expiration is given, where 0 never expires.
+    """
+
+    rds = connect()
+
+    try:
+        expiration = cache_ttl() if expiration is None else expiration
+
+        # write all values of a key at once so readers never mix versions
+        with rds.pipeline(transaction=True) as pipe:
+            for key in data:
+                if expiration == 0:
+                    pipe.set(key, data[key])
+                else:
+                    pipe.set(key, data[key], ex=expiration)
+
+            pipe.execute()
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to write to Redis cache",
+            extra={"keys": str(list(data)), "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
 def increment(key, amount=1):
     """
     Increment value of amount to
@@ -122,3 +368,689 @@ def increment(key, amount=1):
 
     # return fail status
     return False
+
+
+def publish(channel, message):
+    """
+    Publish message to specified channel in Redis.
+    """
+
+    rds = connect()
+
+    try:
+        rds.publish(channel, message)
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to publish to Redis",
+            extra={"channel": channel, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def read_fields(key, fields):
+    """
+    Read specified fields of the hash of specified
+    key and return a list of the values.
+    """
+
+    if not fields:
+        return []
+
+    rds = connect()
+
+    try:
+        values = rds.hmget(key, fields)
+
+        # decode bytes to str and return False if not found
+        return [value.decode("UTF-8") if value else False for value in values]
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to read hash from Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return failed status
+    return False
+
+
+def write_fields(key, data):
+    """
+    Write dict of fields and values to the hash
+    of specified key.
+    """
+
+    if not data:
+        return True
+
+    rds = connect()
+
+    try:
+        rds.hset(key, mapping=data)
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to write hash to Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def add_members(key, members):
+    """
+    Add members to the set of specified key.
+    """
+
+    if not members:
+        return True
+
+    rds = connect()
+
+    try:
+        rds.sadd(key, *members)
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to add to set in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def diff_members(destination, key, *keys):
+    """
+    Store the members of the set of key that are not in
+    the sets of keys in destination and return the count.
+    """
+
+    rds = connect()
+
+    try:
+        return rds.sdiffstore(destination, [key, *keys])
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to compare sets in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def pop_members(key, count):
+    """
+    Remove and return up to count random members
+    from the set of specified key.
+    """
+
+    rds = connect()
+
+    try:
+        return [member.decode("UTF-8") for member in rds.spop(key, count)]
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to pop from set in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def delete(*keys):
+    """
+    Delete specified keys from Redis.
+    """
+
+    rds = connect()
+
+    try:
+        rds.delete(*keys)
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to delete from Redis",
+            extra={"keys": str(keys), "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def take_token(key, rate, capacity, reserve=0):
+    """
+    Take a token from the token bucket of specified key
+    and return 0, or the seconds to wait for a token when
+    the bucket is empty.
+    """
+
+    rds = connect()
+
+    try:
+        return float(rds.eval(TOKEN_BUCKET_SCRIPT, 1, key, rate, capacity, reserve))
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to take token from Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # don't block requests when Redis is unavailable
+    return 0
+
+
+def circuit_allow(key, threshold, timeout, probe=True):
+    """
+    Check if the circuit breaker of specified key allows
+    a request. When probe is set, a half-open circuit lets
+    this request through as probe and blocks others.
+    """
+
+    rds = connect()
+
+    try:
+        return bool(
+            rds.eval(CIRCUIT_ALLOW_SCRIPT, 1, key, threshold, timeout, int(probe))
+        )
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to read circuit breaker from Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # don't block requests when Redis is unavailable
+    return True
+
+
+def circuit_record(key, success, threshold):
+    """
+    Record the result of a request in the circuit
+    breaker of specified key.
+    """
+
+    rds = connect()
+
+    try:
+        rds.eval(CIRCUIT_RECORD_SCRIPT, 1, key, int(success), threshold)
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to write circuit breaker to Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def append_log(key, score, member, size):
+    """
+    Add member with score to the sorted set of specified
+    key, replacing members with the same score, and remove
+    the lowest scored members beyond size.
+    """
+
+    rds = connect()
+
+    try:
+        with rds.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, score, score)
+            pipe.zadd(key, {member: score})
+            pipe.zremrangebyrank(key, 0, -int(size) - 1)
+            pipe.execute()
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to append to log in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def read_schedule(key, until):
+    """
+    Read the members of the retry schedule of specified
+    key that are due at the until timestamp.
+    """
+
+    rds = connect()
+
+    try:
+        members = rds.zrangebyscore(key, "-inf", until)
+        return [member.decode("UTF-8") for member in members]
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to read schedule from Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return failed status
+    return False
+
+
+def schedule(key, members):
+    """
+    Add members to the retry schedule of specified key,
+    due immediately, unless they are already scheduled.
+    """
+
+    if not members:
+        return True
+
+    rds = connect()
+
+    try:
+        rds.zadd(key, {member: time.time() for member in members}, nx=True)
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to schedule in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def reschedule(key, members, backoff, max_backoff):
+    """
+    Count a retry attempt of the members of the retry
+    schedule of specified key and schedule their next
+    attempt with exponential backoff.
+    """
+
+    rds = connect()
+
+    try:
+        with rds.pipeline(transaction=False) as pipe:
+            for member in members:
+                pipe.hincrby(key + ".attempts", member)
+            attempts = pipe.execute()
+
+        now = time.time()
+        rds.zadd(
+            key,
+            {
+                member: now + min(backoff * 2 ** (attempt - 1), max_backoff)
+                for member, attempt in zip(members, attempts)
+            },
+        )
+
+        return dict(zip(members, attempts))
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to reschedule in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+def unschedule(key, members):
+    """
+    Remove the members and their attempts from
+    the retry schedule of specified key.
+    """
+
+    if not members:
+        return True
+
+    rds = connect()
+
+    try:
+        with rds.pipeline(transaction=True) as pipe:
+            pipe.zrem(key, *members)
+            pipe.hdel(key + ".attempts", *members)
+            pipe.execute()
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to unschedule in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+async def async_lock(key, expiration):
+    """
+    Try to acquire a lock on specified key that expires
+    after expiration seconds. Returns the lock token, False
+    if the lock is held by someone else or None on errors.
+    """
+
+    rds = async_connect()
+    token = uuid.uuid4().hex
+
+    try:
+        if await rds.set(key, token, nx=True, ex=int(expiration)):
+            return token
+
+        return False
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to acquire lock in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return error status
+    return None
+
+
+async def async_unlock(key, token):
+    """
+    Release the lock on specified key if it is
+    still held with token.
+    """
+
+    rds = async_connect()
+
+    try:
+        await rds.eval(UNLOCK_SCRIPT, 1, key, token)
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to release lock in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+async def async_take_token(key, rate, capacity, reserve=0):
+    """
+    Take a token from the token bucket of specified key
+    without blocking the event loop.
+    """
+
+    rds = async_connect()
+
+    try:
+        return float(
+            await rds.eval(TOKEN_BUCKET_SCRIPT, 1, key, rate, capacity, reserve)
+        )
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to take token from Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # don't block requests when Redis is unavailable
+    return 0
+
+
+async def async_circuit_allow(key, threshold, timeout, probe=True):
+    """
+    Check if the circuit breaker of specified key allows
+    a request without blocking the event loop.
+    """
+
+    rds = async_connect()
+
+    try:
+        return bool(
+            await rds.eval(CIRCUIT_ALLOW_SCRIPT, 1, key, threshold, timeout, int(probe))
+        )
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to read circuit breaker from Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # don't block requests when Redis is unavailable
+    return True
+
+
+async def async_circuit_record(key, success, threshold):
+    """
+    Record the result of a request in the circuit breaker
+    of specified key without blocking the event loop.
+    """
+
+    rds = async_connect()
+
+    try:
+        await rds.eval(CIRCUIT_RECORD_SCRIPT, 1, key, int(success), threshold)
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to write circuit breaker to Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+async def async_read_with_ttl(keys):
+    """
+    Read specified keys and their remaining ttl from
+    Redis within a single pipeline and return lists
+    of the raw values and ttls.
+    """
+
+    if not keys:
+        return [], []
+
+    rds = async_connect()
+
+    try:
+        async with rds.pipeline(transaction=False) as pipe:
+            pipe.mget(keys)
+            for key in keys:
+                pipe.ttl(key)
+
+            values, *ttls = await pipe.execute()
+
+        # return False if not found
+        values = [value if value else False for value in values]
+
+        return values, ttls
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to read and decode from Redis",
+            extra={"keys": str(keys), "error_msg": redis_error},
+        )
+
+    # return failed status for all keys
+    return [False] * len(keys), [-2] * len(keys)
+
+
+async def async_read_log(key, since, limit):
+    """
+    Read up to limit members of the sorted set of specified
+    key with a score higher than since, ordered by score.
+    """
+
+    rds = async_connect()
+
+    try:
+        return await rds.zrangebyscore(
+            key, "(" + str(since), "+inf", start=0, num=int(limit)
+        )
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to read log from Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return failed status
+    return False
+
+
+async def async_read_fields(key, fields):
+    """
+    Read specified fields of the hash of specified key
+    without blocking the event loop.
+    """
+
+    if not fields:
+        return []
+
+    rds = async_connect()
+
+    try:
+        values = await rds.hmget(key, fields)
+
+        # decode bytes to str and return False if not found
+        return [value.decode("UTF-8") if value else False for value in values]
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to read hash from Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return failed status
+    return False
+
+
+async def async_write_fields(key, data):
+    """
+    Write dict of fields and values to the hash of
+    specified key without blocking the event loop.
+    """
+
+    if not data:
+        return True
+
+    rds = async_connect()
+
+    try:
+        await rds.hset(key, mapping=data)
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to write hash to Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+async def async_write_many(data):
+    """
+    Write dict of keys and values to Redis
+    within a single pipeline.
+    """
+
+    rds = async_connect()
+
+    try:
+        expiration = cache_ttl()
+
+        # write all values of a key at once so readers never mix versions
+        async with rds.pipeline(transaction=True) as pipe:
+            for key in data:
+                if expiration == 0:
+                    pipe.set(key, data[key])
+                else:
+                    pipe.set(key, data[key], ex=expiration)
+
+            await pipe.execute()
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to write to Redis cache",
+            extra={"keys": str(list(data)), "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+async def async_schedule(key, members):
+    """
+    Add members to the retry schedule of specified key,
+    due immediately, unless they are already scheduled.
+    """
+
+    rds = async_connect()
+
+    try:
+        await rds.zadd(key, {member: time.time() for member in members}, nx=True)
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to schedule in Redis",
+            extra={"key": key, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
+
+
+async def async_publish(channel, message):
+    """
+    Publish message to specified channel in Redis
+    without blocking the event loop.
+    """
+
+    rds = async_connect()
+
+    try:
+        await rds.publish(channel, message)
+
+        # return succes status
+        return True
+
+    except Exception as redis_error:
+        logging.error(
+            "An error occured while trying to publish to Redis",
+            extra={"channel": channel, "error_msg": redis_error},
+        )
+
+    # return fail status
+    return False
@@ -0,0 +1,103 @@
+import config
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# reusable encoders with the output format of the API
+_compact = json.JSONEncoder(sort_keys=True)
+_pretty = json.JSONEncoder(sort_keys=True, indent=4)
+
+# runs of DEL and UTF-8 encoded characters that json.dumps escapes
+_NON_ASCII = re.compile(rb"[\x7f-\xff]+")
+
+
+def backend():
+    """
+    Return the name of the JSON backend in use.
+    """
+
+    if config.json_backend == "json" or orjson is None:
+        return "json"
+
+    return "orjson"
+
+
+def dumps(obj, pretty=False):
+    """
+    Serialize obj to JSON bytes with sorted keys, equal to
+    the output of json.dumps and indented by 4 spaces when
+    pretty. Compact output always uses the C encoder of
+    json, which is faster than orjson plus rewriting its
+    output to the same format.
+    """
+
+    if pretty and backend() == "orjson":
+        content = _orjson_pretty(obj)
+        if content:
+            return content
+
+    if pretty:
+        return _pretty.encode(obj).encode("utf-8")
+
+    return _compact.encode(obj).encode("utf-8")
+
+
+def loads(data):
+    """
+    Deserialize JSON str or bytes.
+    """
+
+    if backend() == "orjson":
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # integers beyond 64 bit are only supported by json
+            pass
+
+    return json.loads(data)
+
+
+def _orjson_pretty(obj):
+    """
+    Serialize obj indented with orjson and rewrite the output
+    to the format of json.dumps. Returns False when orjson
+    can't serialize obj, like dicts with non-str keys or
+    integers beyond 64 bit. Floats in exponent notation are
+    formatted differently, product info from Steam contains
+    no floats.
+    """
+
+    try:
+        content = orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+    except orjson.JSONEncodeError:
+        return False
+
+    # json.dumps escapes non-ASCII characters and DEL
+    if not content.isascii() or b"\x7f" in content:
+        content = _NON_ASCII.sub(_escape, content)
+
+    # newlines only occur between tokens, so only the indentation
+    # of 2 spaces per level has to be doubled
+    lines = content.split(b"\n")
+
+    return b"\n".join(
+        [line[: len(line) - len(line.lstrip(b" "))] + line for line in lines]
+    )
+
+
+def _escape(match):
+    """
+    Return a run of UTF-8 encoded characters escaped like
+    json.dumps does, as lowercase UTF-16 code units, so
+    characters outside the BMP become surrogate pairs.
+    """
+
+    units = match.group().decode("utf-8").encode("utf-16-be").hex()
+
+    return "".join(["\\u" + units[i : i + 4] for i in range(0, len(units), 4)]).encode(
+        "ascii"
+    )
@@ -1,7 +1,43 @@
+import asyncio
 import gevent
+import gevent.event
 import logging
+import os
+import queue
+import re
 import requests
+import threading
+import time
+import utils.redis
+import config
+from concurrent.futures import Future
 from steam.client import SteamClient
+from steam.enums import EResult
+
+# sessions and request queue of the current process
+_sessions_lock = threading.Lock()
+_sessions_pid = None
+_jobs = queue.Queue()
+_wakeups = []
+
+# token bucket of the Steam requests of all processes
+RATE_LIMIT_KEY = "_state.rate_limit.steam"
+
+# circuit breaker state of the Steam requests of all processes
+CIRCUIT_KEY = "_state.circuit.steam"
+
+# app id's in the GetAppList response
+APP_ID_PATTERN = re.compile(rb'"appid":\s*(\d+)')
+
+
+class Unavailable(Exception):
+    """
+    Raised when a Steam request is not sent because of
+    the circuit breaker or the rate limit.
+    """
+
+
+## client functions
 
 
 def init_client():
@@ -12,141 +48,464 @@ def init_client():
 
     logging.debug("Connecting via steamclient to steam api")
     client = SteamClient()
-    client.anonymous_login()
     client.verbose_debug = False
 
+    result = client.anonymous_login()
+    if result != EResult.OK:
+        close_client(client)
+        raise Exception("Anonymous login failed with result: " + str(result))
+
     return client
 
 
-def get_app_list():
+def close_client(client):
     """
-    Get list of id's of all current apps in
-    Steam and return them in a flat list.
+    Logout and disconnect the client while
+    ignoring errors of broken connections.
     """
 
-    response = requests.get("https://api.steampowered.com/ISteamApps/GetAppList/v2/")
-    response_json = response.json()
+    if not client:
+        return
 
-    apps = []
-    if response.status_code != 200:
-        logging.error("The Steam GetAppList API endpoint returned a non-200 http code")
-        return False
+    try:
+        client._connecting = False
+        client.logout()
+        client.disconnect()
 
-    else:
-        for app in response_json["applist"]["apps"]:
-            apps.append(app["appid"])
+    except Exception as err:
+        logging.debug("Failed to cleanly close steam client: " + str(err))
 
-    return apps
 
+def client_healthy(client):
+    """
+    Check if the client is still connected
+    and logged on.
+    """
 
-def get_change_number():
+    return bool(client) and client.connected and client.logged_on
+
+
+## session pool functions
+
+
+def start_sessions(pool_size=None):
     """
-    Get and return the latest change number.
+    Start the session threads of the pool for the
+    current process, STEAM_POOL_SIZE by default.
+    Threads don't survive a fork so forked workers
+    will start a new pool.
     """
 
-    connect_retries = 2
-    connect_timeout = 3
-    client = None
+    global _sessions_pid, _jobs, _wakeups
 
-    try:
-        # Sometimes it hangs for 30+ seconds. Normal connection takes about 500ms
-        for _ in range(connect_retries):
-            count = str(_)
+    if _sessions_pid == os.getpid():
+        return
 
-            try:
-                with gevent.Timeout(connect_timeout):
+    with _sessions_lock:
+        if _sessions_pid == os.getpid():
+            return
 
-                    client = init_client()
-                    info = client.get_changes_since(
-                        1, app_changes=False, package_changes=False
-                    )
-                    change_number = info.current_change_number
+        _jobs = queue.Queue()
+        _wakeups = []
+
+        pool_size = pool_size or int(config.steam_pool_size)
+
+        for number in range(pool_size):
+            started = threading.Event()
+            thread = threading.Thread(
+                target=_session,
+                args=(_jobs, started),
+                name="steam-session-" + str(number),
+                daemon=True,
+            )
+            thread.start()
+            started.wait()
+
+        logging.info(
+            "Started steam session pool",
+            extra={"pool_size": pool_size},
+        )
+        _sessions_pid = os.getpid()
+
+
+def request(func, *args, timeout=3):
+    """
+    Queue func to be called with a logged in client
+    from the session pool and return a future of the
+    result.
+    """
+
+    start_sessions()
+
+    future = Future()
+    _jobs.put((future, func, args, timeout))
+
+    for wakeup in _wakeups:
+        wakeup.send()
+
+    return future
+
+
+def _session(jobs, started):
+    """
+    Keep a logged in client and run the queued requests
+    with it. The gevent hub of this thread keeps running
+    while idle so the client keeps sending heartbeats.
+    """
+
+    wakeup = gevent.event.Event()
+    watcher = gevent.get_hub().loop.async_()
+    watcher.start(wakeup.set)
+    _wakeups.append(watcher)
+    started.set()
+
+    client = _connect(None)
+
+    while True:
+        wakeup.clear()
 
-                    client.logout()
+        try:
+            future, func, args, timeout = jobs.get_nowait()
 
-                    return change_number
+        except queue.Empty:
+            # check idle session and reconnect before it is needed again
+            if not wakeup.wait(timeout=int(config.steam_pool_keepalive)):
+                client = _connect(client)
+            continue
 
-            except gevent.timeout.Timeout:
-                if client:
-                    client._connecting = False
-                    client.logout()
+        if not future.set_running_or_notify_cancel():
+            continue
 
-            else:
-                break
+        client, result, error = _run(client, func, args, timeout)
+
+        if error:
+            future.set_exception(error)
         else:
-            if client:
-                client._connecting = False
-                client.logout()
-            raise Exception(f"Max connect retries ({connect_retries}) exceeded")
+            future.set_result(result)
+
+
+def _connect(client, connect_timeout=5):
+    """
+    Return the client if it is healthy, otherwise
+    replace it by a newly logged in client.
+    """
+
+    if client_healthy(client):
+        return client
+
+    close_client(client)
+
+    try:
+        with gevent.Timeout(connect_timeout):
+            return init_client()
+
+    except gevent.Timeout:
+        logging.warning("Encountered timeout when trying to connect to steam api")
 
     except Exception as err:
-        if client:
-            client._connecting = False
-            client.logout()
+        logging.warning("Failed to connect to steam api with error: " + str(err))
 
-        logging.error(
-            "Encountered the following error when trying to retrieve latest change number: "
-            + str(err)
+    return None
+
+
+def _run(client, func, args, timeout, connect_retries=2):
+    """
+    Call func with the client and reconnect and retry
+    when the call times out or fails.
+    """
+
+    error = Exception(f"Max connect retries ({connect_retries}) exceeded")
+
+    # Sometimes it hangs for 30+ seconds. Normal connection takes about 500ms
+    for retry in range(connect_retries):
+        try:
+            with gevent.Timeout(timeout):
+                if not client_healthy(client):
+                    close_client(client)
+                    client = init_client()
+
+                return client, func(client, *args), None
+
+        except gevent.Timeout:
+            logging.warning(
+                "Encountered timeout when trying to connect to steam api. Retrying..",
+                extra={"retry_count": str(retry)},
+            )
+
+        except Exception as err:
+            logging.warning(
+                "Encountered error in steam session. Retrying..",
+                extra={"retry_count": str(retry), "error_msg": str(err)},
+            )
+            error = err
+
+        close_client(client)
+        client = None
+
+    return client, None, error
+
+
+## rate limit functions
+
+
+def rate_limit(background=True):
+    """
+    Wait until a Steam request is allowed by the rate
+    limit shared by all processes. Background requests
+    leave the reserved part of the budget to interactive
+    requests.
+    """
+
+    rate = float(config.steam_rate_limit)
+    if rate == 0:
+        return
+
+    reserve = float(config.steam_rate_reserve) if background else 0
+    deadline = time.monotonic() + float(config.steam_rate_wait)
+
+    while True:
+        wait = utils.redis.take_token(
+            RATE_LIMIT_KEY, rate, float(config.steam_rate_burst), reserve
+        )
+        if wait == 0:
+            return
+
+        if time.monotonic() + wait > deadline:
+            raise Unavailable("Rate limit of Steam requests exceeded")
+
+        time.sleep(wait)
+
+
+async def async_rate_limit(background=False):
+    """
+    Wait until a Steam request is allowed by the rate
+    limit without blocking the event loop.
+    """
+
+    rate = float(config.steam_rate_limit)
+    if rate == 0:
+        return
+
+    reserve = float(config.steam_rate_reserve) if background else 0
+    deadline = time.monotonic() + float(config.steam_rate_wait)
+
+    while True:
+        wait = await utils.redis.async_take_token(
+            RATE_LIMIT_KEY, rate, float(config.steam_rate_burst), reserve
         )
+        if wait == 0:
+            return
+
+        if time.monotonic() + wait > deadline:
+            raise Unavailable("Rate limit of Steam requests exceeded")
+
+        await asyncio.sleep(wait)
+
+
+## circuit breaker functions
+
+
+def circuit_enabled():
+    """
+    Check if the circuit breaker is enabled, which
+    requires the cache to share its state.
+    """
+
+    return config.cache == "True" and int(config.steam_circuit_failures) > 0
+
+
+def circuit_open():
+    """
+    Check if the circuit breaker of Steam requests is
+    open, in which case requests fail immediately.
+    """
+
+    if not circuit_enabled():
         return False
 
+    return not utils.redis.circuit_allow(
+        CIRCUIT_KEY,
+        int(config.steam_circuit_failures),
+        int(config.steam_circuit_timeout),
+        probe=False,
+    )
 
-def get_changes_since_change_number(change_number):
+
+async def async_circuit_open():
+    """
+    Check if the circuit breaker of Steam requests is
+    open without blocking the event loop.
+    """
+
+    if not circuit_enabled():
+        return False
+
+    return not await utils.redis.async_circuit_allow(
+        CIRCUIT_KEY,
+        int(config.steam_circuit_failures),
+        int(config.steam_circuit_timeout),
+        probe=False,
+    )
+
+
+def call(func, *args, timeout=3, background=True):
     """
-    Get and return lists of changed apps and
-    packages since the specified change number.
+    Call func with a client from the session pool within
+    the rate limit and circuit breaker and return the
+    result.
     """
 
-    connect_retries = 2
-    connect_timeout = 3
-    client = None
+    breaker = circuit_enabled()
+    threshold = int(config.steam_circuit_failures)
+
+    if circuit_open():
+        raise Unavailable("Circuit breaker of Steam requests is open")
+
+    # only take the probe of a half-open circuit when the request is sent
+    rate_limit(background)
+
+    if breaker and not utils.redis.circuit_allow(
+        CIRCUIT_KEY, threshold, int(config.steam_circuit_timeout)
+    ):
+        raise Unavailable("Circuit breaker of Steam requests is open")
 
     try:
-        # Sometimes it hangs for 30+ seconds. Normal connection takes about 500ms
-        for _ in range(connect_retries):
-            count = str(_)
+        result = request(func, *args, timeout=timeout).result()
 
-            try:
-                with gevent.Timeout(connect_timeout):
+    except Exception:
+        if breaker:
+            utils.redis.circuit_record(CIRCUIT_KEY, False, threshold)
+        raise
 
-                    client = init_client()
-                    info = client.get_changes_since(
-                        int(change_number), app_changes=True, package_changes=True
-                    )
+    if breaker:
+        utils.redis.circuit_record(CIRCUIT_KEY, True, threshold)
 
-                    app_list = []
-                    if info.app_changes:
-                        for app in info.app_changes:
-                            app_list.append(app.appid)
+    return result
 
-                    package_list = []
-                    if info.package_changes:
-                        for package in info.package_changes:
-                            package_list.append(package.packageid)
 
-                    changes = {"apps": app_list, "packages": package_list}
+async def async_call(func, *args, timeout=3, background=False):
+    """
+    Call func with a client from the session pool within
+    the rate limit and circuit breaker without blocking
+    the event loop.
+    """
 
-                    client.logout()
+    breaker = circuit_enabled()
+    threshold = int(config.steam_circuit_failures)
 
-                    return changes
+    if await async_circuit_open():
+        raise Unavailable("Circuit breaker of Steam requests is open")
 
-            except gevent.timeout.Timeout:
-                if client:
-                    client._connecting = False
-                    client.logout()
+    # only take the probe of a half-open circuit when the request is sent
+    await async_rate_limit(background)
 
-            else:
-                break
-        else:
-            if client:
-                client._connecting = False
-                client.logout()
-            raise Exception(f"Max connect retries ({connect_retries}) exceeded")
+    if breaker and not await utils.redis.async_circuit_allow(
+        CIRCUIT_KEY, threshold, int(config.steam_circuit_timeout)
+    ):
+        raise Unavailable("Circuit breaker of Steam requests is open")
+
+    try:
+        result = await asyncio.wrap_future(request(func, *args, timeout=timeout))
+
+    except Exception:
+        if breaker:
+            await utils.redis.async_circuit_record(CIRCUIT_KEY, False, threshold)
+        raise
+
+    if breaker:
+        await utils.redis.async_circuit_record(CIRCUIT_KEY, True, threshold)
+
+    return result
+
+
+## steam functions
+
+
+def get_app_list():
+    """
+    Get list of id's of all current apps in
+    Steam and return them in a flat list.
+    """
+
+    try:
+        return list(iter_app_list())
+
+    except Exception as err:
+        logging.error("Failed to retrieve the Steam app list with error: " + str(err))
+        return False
+
+
+def iter_app_list(chunk_size=65536):
+    """
+    Stream the Steam GetAppList response and yield the id's
+    of all current apps without loading the whole list.
+    """
+
+    with requests.get(
+        "https://api.steampowered.com/ISteamApps/GetAppList/v2/",
+        stream=True,
+        timeout=30,
+    ) as response:
+        if response.status_code != 200:
+            raise Exception(
+                "The Steam GetAppList API endpoint returned a non-200 http code"
+            )
+
+        rest = b""
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            data = rest + chunk
+            end = 0
+
+            for match in APP_ID_PATTERN.finditer(data):
+                # an id at the end of the chunk may continue in the next one
+                if match.end() == len(data):
+                    break
+                end = match.end()
+                yield int(match.group(1))
+
+            rest = data[max(end, len(data) - 64) :]
+
+        for match in APP_ID_PATTERN.finditer(rest):
+            yield int(match.group(1))
+
+
+def get_change_number():
+    """
+    Get and return the latest change number.
+    """
+
+    try:
+        return call(_change_number)
+
+    except Exception as err:
+        logging.error(
+            "Encountered the following error when trying to retrieve latest change number: "
+            + str(err)
+        )
+        return False
+
+
+def _change_number(client):
+    """
+    Request the latest change number with client.
+    """
+
+    info = client.get_changes_since(1, app_changes=False, package_changes=False)
+
+    return info.current_change_number
+
+
+def get_changes_since_change_number(change_number):
+    """
+    Get and return lists of changed apps and packages
+    since the specified change number together with the
+    current change number.
+    """
+
+    try:
+        return call(_changes_since, int(change_number))
 
     except Exception as err:
-        if client:
-            client._connecting = False
-            client.logout()
         logging.error(
             "Failed in get changes since last change number with error: " + str(err),
             extra={"changenumber": str(change_number)},
@@ -154,92 +513,165 @@ def get_changes_since_change_number(change_number):
         return False
 
 
-def get_apps_info(apps=[]):
+def _changes_since(client, change_number):
     """
-    Get product info for list of apps and
-    return the output untouched.
+    Request the changed apps and packages since
+    change number with client.
     """
 
-    connect_retries = 2
-    connect_timeout = 3
-    client = None
+    info = client.get_changes_since(
+        change_number, app_changes=True, package_changes=True
+    )
+
+    app_list = []
+    if info.app_changes:
+        for app in info.app_changes:
+            app_list.append(app.appid)
+
+    package_list = []
+    if info.package_changes:
+        for package in info.package_changes:
+            package_list.append(package.packageid)
+
+    return {
+        "change_number": info.current_change_number,
+        "apps": app_list,
+        "packages": package_list,
+    }
+
+
+def get_apps_info(apps=[], raise_errors=False):
+    """
+    Get product info for list of apps and
+    return the output untouched. Returns False
+    on failure unless raise_errors is set.
+    """
 
     logging.info("Started requesting app info", extra={"apps": str(apps)})
 
     try:
-        # Sometimes it hangs for 30+ seconds. Normal connection takes about 500ms
-        for _ in range(connect_retries):
-            count = str(_)
+        info = call(_apps_info, apps, timeout=apps_timeout(apps) + 2)
+
+    except Exception as err:
+        logging.error(
+            "Failed in retrieving app info with error: " + str(err),
+            extra={"apps": str(apps)},
+        )
+        if raise_errors:
+            raise
+        return False
 
-            try:
-                with gevent.Timeout(connect_timeout):
-                    logging.info(
-                        "Retrieving app info from steamclient",
-                        extra={"apps": str(apps), "retry_count": count},
-                    )
+    logging.info("Succesfully retrieved app info", extra={"apps": str(apps)})
 
-                    client = init_client()
+    return info
 
-                    logging.debug(
-                        "Requesting app info from steam api", extra={"apps": str(apps)}
-                    )
-                    info = client.get_product_info(apps=apps, timeout=1)
-                    info = info["apps"]
-
-                    client.logout()
-
-                    return info
-
-            except gevent.timeout.Timeout:
-                logging.warning(
-                    "Encountered timeout when trying to connect to steam api. Retrying.."
-                )
-                if client:
-                    client._connecting = False
-                    client.logout()
-
-            else:
-                logging.info(
-                    "Succesfully retrieved app info", extra={"apps": str(apps)}
-                )
-                break
-        else:
-            if client:
-                client._connecting = False
-                client.logout()
-            logging.error(
-                "Max connect retries exceeded",
-                extra={"apps": str(apps), "connect_retries": connect_retries},
-            )
-            raise Exception(f"Max connect retries ({connect_retries}) exceeded")
+
+async def async_get_apps_info(apps=[], background=False, raise_errors=False):
+    """
+    Get product info for list of apps without
+    blocking the event loop.
+    """
+
+    logging.info("Started requesting app info", extra={"apps": str(apps)})
+
+    try:
+        info = await async_call(
+            _apps_info, apps, timeout=apps_timeout(apps) + 2, background=background
+        )
 
     except Exception as err:
-        if client:
-            client._connecting = False
-            client.logout()
         logging.error(
             "Failed in retrieving app info with error: " + str(err),
             extra={"apps": str(apps)},
         )
+        if raise_errors:
+            raise
         return False
 
+    logging.info("Succesfully retrieved app info", extra={"apps": str(apps)})
 
-def get_packages_info(packages=[]):
+    return info
+
+
+def apps_timeout(apps):
+    """
+    Return the product info timeout for list of apps,
+    which is 1 second per 10 apps.
+    """
+
+    return max(1, len(apps) / 10)
+
+
+def _apps_info(client, apps):
+    """
+    Request product info for list of apps
+    with client.
+    """
+
+    logging.debug("Requesting app info from steam api", extra={"apps": str(apps)})
+    info = client.get_product_info(apps=apps, timeout=apps_timeout(apps))
+
+    return info["apps"]
+
+
+def get_packages_info(packages=[], raise_errors=False):
     """
     Get product info for list of packages and
-    return the output untouched.
+    return the output untouched. Returns False
+    on failure unless raise_errors is set.
     """
 
     try:
-        client = init_client()
-        info = client.get_product_info(packages=packages, timeout=5)
-        info = info["packages"]
+        info = call(_packages_info, packages, timeout=6)
+
     except Exception as err:
         logging.error(
             "Something went wrong while querying product info for packages: "
             + str(packages)
         )
         logging.error(err)
+        if raise_errors:
+            raise
+        return False
+
+    return info
+
+
+async def async_get_packages_info(packages=[], background=False, raise_errors=False):
+    """
+    Get product info for list of packages without
+    blocking the event loop.
+    """
+
+    logging.info("Started requesting package info", extra={"packages": str(packages)})
+
+    try:
+        info = await async_call(
+            _packages_info, packages, timeout=6, background=background
+        )
+
+    except Exception as err:
+        logging.error(
+            "Failed in retrieving package info with error: " + str(err),
+            extra={"packages": str(packages)},
+        )
+        if raise_errors:
+            raise
         return False
 
+    logging.info(
+        "Succesfully retrieved package info", extra={"packages": str(packages)}
+    )
+
     return info
+
+
+def _packages_info(client, packages):
+    """
+    Request product info for list of packages
+    with client.
+    """
+
+    info = client.get_product_info(packages=packages, timeout=5)
+
+    return info["packages"]
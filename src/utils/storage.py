@@ -1,11 +1,34 @@
-from job import logger
 import utils.helper
 import config
 import logging
+import hashlib
+import certifi
+import tempfile
+import threading
+import urllib3
+import gzip
 import os
+from concurrent.futures import ThreadPoolExecutor
 from minio import Minio
 from io import BytesIO
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# reused by all threads of the current process, created on first use
+_lock = threading.Lock()
+_client_pid = None
+_client = None
+_executor_pid = None
+_executor = None
+_workers = None
+
+# first bytes of compressed local files
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
 
 ## meta functions
 
@@ -43,38 +66,187 @@ def write(content, path, filename):
     return response
 
 
-def list(path):
+def list(path, details=False, recursive=False):
     """
-    List files in specified directory and return
-    it as a list.
+    Yield the names of the files in specified directory,
+    relative to it. With details a dict with the name,
+    size, etag and modification time is yielded instead.
+    Recursive includes files in subdirectories, like the
+    shards of a directory (app/00/, app/01/, ...).
     """
 
     match config.storage_type:
         case "local":
-            response = local_list(path)
+            return local_list(path, details, recursive)
         case "object":
-            response = object_list(path)
+            return object_list(path, details, recursive)
         case _:
-            response = False
+            return iter(())
 
-    return response
+
+def read_many(path, filenames):
+    """
+    Read files from specified directory in parallel
+    and return the contents in the same order.
+    """
+
+    return [*executor().map(lambda filename: read(path, filename), filenames)]
+
+
+def write_many(contents, path):
+    """
+    Write a dict of filenames and contents to the specified
+    directory/path in parallel and return a dict of
+    filenames and whether they were written.
+    """
+
+    if config.storage_type != "local":
+        results = executor().map(
+            lambda filename: write(contents[filename], path, filename), contents
+        )
+        return dict(zip(contents, results))
+
+    # sync the directories once per batch instead of once per file
+    results = executor().map(
+        lambda filename: local_write(
+            contents[filename], path, filename, sync_directory=False
+        ),
+        contents,
+    )
+    results = dict(zip(contents, results))
+
+    if config.storage_fsync == "True":
+        local_sync(
+            {
+                os.path.dirname(local_file(path, filename))
+                for filename, result in results.items()
+                if result
+            }
+        )
+
+    return results
+
+
+def executor(workers=None):
+    """
+    Return the thread pool of the current process that
+    reads and writes files in parallel and create a new
+    one after a fork. The first call sets the number of
+    workers, which defaults to STORAGE_WORKERS.
+    """
+
+    global _executor, _executor_pid, _workers
+
+    if _executor_pid == os.getpid():
+        return _executor
+
+    with _lock:
+        if _executor_pid != os.getpid():
+            _workers = workers or int(config.storage_workers)
+            _executor = ThreadPoolExecutor(
+                max_workers=_workers, thread_name_prefix="storage"
+            )
+            _executor_pid = os.getpid()
+
+    return _executor
 
 
 ## local storage functions
 
 
-def local_read(path, filename):
+def local_file(path, filename, layout=None):
     """
-    Read file from local specified directory.
+    Return the full path of a file in specified local
+    directory. With the sharded layout files are spread
+    over 256 subdirectories by the hash of their name.
     """
 
     path = utils.helper.combine_paths(config.storage_directory, path)
     path = utils.helper.normalize_directory(path)
-    file = path + filename
+
+    if (layout or config.storage_layout) == "sharded":
+        path = path + shard(filename) + "/"
+
+    return path + filename
+
+
+def shard(filename):
+    """
+    Return the subdirectory of a file in
+    the sharded layout, from 00 to ff.
+    """
+
+    return hashlib.blake2b(filename.encode("utf-8"), digest_size=1).hexdigest()
+
+
+def compression(data=None):
+    """
+    Return the compression of data based on its first bytes,
+    or the configured compression when no data is given. zstd
+    falls back to gzip when zstandard is not installed.
+    """
+
+    if data is not None:
+        if data.startswith(GZIP_MAGIC):
+            return "gzip"
+        if data.startswith(ZSTD_MAGIC):
+            return "zstd"
+        return "none"
+
+    if config.storage_compression == "zstd" and zstandard is None:
+        return "gzip"
+
+    return config.storage_compression
+
+
+def compress(data):
+    """
+    Compress data with the configured compression.
+    """
+
+    match compression():
+        case "zstd":
+            return zstandard.ZstdCompressor().compress(data)
+        case "gzip":
+            return gzip.compress(data, compresslevel=6, mtime=0)
+        case _:
+            return data
+
+
+def decompress(data):
+    """
+    Decompress data with the compression it was
+    written with, regardless of the configuration.
+    """
+
+    match compression(data):
+        case "zstd":
+            return zstandard.ZstdDecompressor().decompress(data)
+        case "gzip":
+            return gzip.decompress(data)
+        case _:
+            return data
+
+
+def local_read(path, filename):
+    """
+    Read file from local specified directory.
+    """
+
+    file = local_file(path, filename)
 
     try:
-        content = open(file, "r")
-        content = content.read()
+        try:
+            with open(file, "rb") as f:
+                data = f.read()
+
+        except FileNotFoundError:
+            # files are moved to the configured layout by migrate.py
+            layout = "flat" if config.storage_layout == "sharded" else "sharded"
+            with open(local_file(path, filename, layout), "rb") as f:
+                data = f.read()
+
+        content = decompress(data).decode("utf-8")
 
     except Exception:
         logging.error("The following file could not be read: " + file)
@@ -83,37 +255,67 @@ def local_read(path, filename):
     return content
 
 
-def local_write(content, path, filename):
+def local_write(content, path, filename, sync_directory=True):
     """
     Write content to file to local specified
-    directory.
+    directory. The file is replaced at once, so
+    readers never see a partially written file.
     """
 
-    path = utils.helper.combine_paths(config.storage_directory, path)
-    path = utils.helper.normalize_directory(path)
-    file = path + filename
+    file = local_file(path, filename)
+    directory = os.path.dirname(file)
 
     try:
-        f = open(file, "w")
-        f.write(content)
-        f.close()
+        os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=directory, prefix="." + filename, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compress(content.encode("utf-8")))
+
+                if config.storage_fsync == "True":
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            os.chmod(temp, 0o644)
+            os.replace(temp, file)
+
+        except Exception:
+            os.remove(temp)
+            raise
+
+        if sync_directory and config.storage_fsync == "True":
+            local_sync([directory])
+
         logging.info("Written the following file: " + file)
 
     except Exception:
-        logger.error("The following file could not be written locally: " + file)
+        logging.error("The following file could not be written locally: " + file)
         return False
 
     return True
 
 
+def local_sync(directories):
+    """
+    Flush the entries of specified local directories
+    to disk so replaced files survive a crash.
+    """
+
+    for directory in directories:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
 def local_delete(path, filename):
     """
     Delete file in local specified directory.
     """
 
-    path = utils.helper.combine_paths(config.storage_directory, path)
-    path = utils.helper.normalize_directory(path)
-    file = path + filename
+    file = local_file(path, filename)
 
     try:
         os.remove(file)
@@ -129,23 +331,57 @@ def local_delete(path, filename):
     return True
 
 
-def local_list(path):
+def local_list(path, details=False, recursive=False):
     """
-    List files in specified local directory and
-    return it as a list.
+    Yield the files in specified local directory
+    while it is being read.
     """
 
     path = utils.helper.combine_paths(config.storage_directory, path)
     path = utils.helper.normalize_directory(path)
 
+    yield from local_scan(path, "", details, recursive)
+
+
+def local_scan(path, prefix, details, recursive):
+    """
+    Yield the files in the prefix subdirectory of
+    specified local directory and optionally in
+    its subdirectories.
+    """
+
     try:
-        content = os.listdir(path)
+        entries = os.scandir(path + prefix)
 
     except Exception:
-        logging.error("The following directory could not be read: " + path)
-        return False
-
-    return content
+        logging.error("The following directory could not be read: " + path + prefix)
+        return
+
+    with entries:
+        for entry in entries:
+            # skip files that are being written
+            if entry.name.startswith("."):
+                continue
+
+            if entry.is_dir():
+                if recursive:
+                    yield from local_scan(
+                        path, prefix + entry.name + "/", details, recursive
+                    )
+                continue
+
+            if not details:
+                yield prefix + entry.name
+                continue
+
+            # scandir caches the stat result on some platforms
+            stat = entry.stat()
+            yield {
+                "name": prefix + entry.name,
+                "size": stat.st_size,
+                "etag": None,
+                "modified": stat.st_mtime,
+            }
 
 
 ## object store functions
@@ -153,23 +389,59 @@ def local_list(path):
 
 def object_connect():
     """
-    Connect to object store with credentials set
-    in config environment variables.
+    Return the object store client of the current process,
+    connected with credentials set in config environment
+    variables, and create a new one after a fork.
+    """
+
+    global _client, _client_pid
+
+    if _client_pid == os.getpid():
+        return _client
+
+    # size the connection pool after the thread pool
+    executor()
+
+    with _lock:
+        if _client_pid != os.getpid():
+            _client = create_client()
+            _client_pid = os.getpid()
+
+    return _client
+
+
+def create_client():
+    """
+    Create an object store client with a connection
+    for every storage thread.
     """
 
+    timeout = float(config.storage_object_timeout)
+
+    # a connection per storage thread, retried like the default client
+    http_client = urllib3.PoolManager(
+        timeout=urllib3.Timeout(connect=timeout, read=timeout),
+        maxsize=_workers,
+        block=True,
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=urllib3.Retry(
+            total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]
+        ),
+    )
+
     arguments = {
         "endpoint": config.storage_object_endpoint,
         "access_key": config.storage_object_access_key,
         "secret_key": config.storage_object_secret_key,
         "secure": str(config.storage_object_secure).lower() == "true",
+        "http_client": http_client,
     }
 
     if config.storage_object_region:
         arguments["region"] = config.storage_object_region
 
-    client = Minio(**arguments)
-
-    return client
+    return Minio(**arguments)
 
 
 def object_read(path, filename):
@@ -180,14 +452,22 @@ def object_read(path, filename):
 
     file = path + filename
     conn = object_connect()
+    response = None
 
     try:
-        content = conn.get_object(config.storage_object_bucket, file)
+        response = conn.get_object(config.storage_object_bucket, file)
+        content = b"".join(response.stream(65536)).decode("utf-8")
 
     except Exception:
         logging.error("The following file could not be retrieved: " + file)
         return False
 
+    finally:
+        # return the connection to the pool
+        if response is not None:
+            response.close()
+            response.release_conn()
+
     return content
 
 
@@ -198,18 +478,25 @@ def object_write(content, path, filename):
     """
 
     content = content.encode("utf-8")
+    length = len(content)
     content = BytesIO(content)
 
     file = path + filename
     conn = object_connect()
-    resp = conn.put_object(
-        config.storage_object_bucket,
-        file,
-        content,
-        length=-1,
-        part_size=10485760,
-        content_type="application/json",
-    )
+
+    try:
+        # with a known length files below 5 MiB are uploaded in a single part
+        resp = conn.put_object(
+            config.storage_object_bucket,
+            file,
+            content,
+            length=length,
+            content_type="application/json",
+        )
+
+    except Exception:
+        logging.error("The following file could not be uploaded: " + file)
+        return False
 
     return resp
 
@@ -226,25 +513,33 @@ def object_delete(path, filename):
     return resp
 
 
-def object_list(path, details=False):
+def object_list(path, details=False, recursive=False):
     """
-    List files in specified directory in object
-    storage and return it as a list.
+    Yield the files in specified directory in object
+    storage while the pages of the listing are retrieved.
     """
 
     conn = object_connect()
 
     try:
-        files = conn.list_objects(config.storage_object_bucket, prefix=path)
-        file_list = []
+        for file in conn.list_objects(
+            config.storage_object_bucket, prefix=path, recursive=recursive
+        ):
+            if file.is_dir:
+                continue
+
+            name = file.object_name[len(path) :]
 
-        for file in files:
-            file = file.object_name
-            file = file.split("/")[-1]
-            file_list.append(file)
+            if not details:
+                yield name
+                continue
+
+            yield {
+                "name": name,
+                "size": file.size,
+                "etag": file.etag,
+                "modified": file.last_modified.timestamp(),
+            }
 
     except Exception:
         logging.error("The files in following directory could not be listed: " + path)
-        return False
-
-    return file_list
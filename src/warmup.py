@@ -0,0 +1,319 @@
+"""
+Warm-up command that preloads the cache.
+"""
+
+# import modules
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+
+import config
+import utils.cache
+import utils.redis
+import utils.serializer
+import utils.steam
+import utils.storage
+
+logger = logging.getLogger(__name__)
+
+
+def storage_batches(kind, start, batch_size):
+    """
+    Yield batches of ids, values and change numbers of all
+    apps or packages in storage, read in parallel.
+    """
+
+    files = utils.storage.list(kind + "/", recursive=True)
+    item_ids = sorted(
+        int(file.split("/")[-1][:-5]) for file in files if file.endswith(".json")
+    )
+
+    for i in range(start, len(item_ids), batch_size):
+        batch = item_ids[i : i + batch_size]
+        contents = utils.storage.read_many(
+            kind + "/", [str(item_id) + ".json" for item_id in batch]
+        )
+
+        yield len(batch), [
+            stored_item(item_id, content)
+            for item_id, content in zip(batch, contents)
+            if content
+        ]
+
+
+def snapshot_batches(file, start, batch_size):
+    """
+    Yield batches of ids and values from a snapshot file
+    with one cached value per line, optionally gzipped.
+    Snapshot values are not necessarily in storage, so
+    they have no change number for the manifest.
+    """
+
+    opener = gzip.open if file.endswith(".gz") else open
+    batch = []
+    read = 0
+
+    with opener(file, "rb") as snapshot:
+        for number, line in enumerate(snapshot):
+            if number < start:
+                continue
+
+            read += 1
+            value = line.strip()
+
+            if value:
+                item_id = int(next(iter(utils.serializer.loads(value))))
+                batch.append((item_id, value, None))
+
+            if len(batch) == batch_size:
+                yield read, batch
+                batch = []
+                read = 0
+
+    if read:
+        yield read, batch
+
+
+def hot_batches(kind, file, start, batch_size):
+    """
+    Yield batches of ids, values and change numbers of the
+    ids listed in a file, ordered by priority. Ids are read
+    from storage when enabled and otherwise requested from
+    Steam and stored.
+    """
+
+    with open(file) as hot:
+        item_ids = [int(line) for line in hot if line.strip()]
+
+    for i in range(start, len(item_ids), batch_size):
+        batch = item_ids[i : i + batch_size]
+        items = {}
+
+        if config.storage == "True":
+            contents = utils.storage.read_many(
+                kind + "/", [str(item_id) + ".json" for item_id in batch]
+            )
+            for item_id, content in zip(batch, contents):
+                if content:
+                    items[item_id] = stored_item(item_id, content)
+
+        missing = [item_id for item_id in batch if item_id not in items]
+        if missing:
+            # a failure stops the warm-up before the checkpoint passes the batch
+            if kind == "package":
+                info = utils.steam.get_packages_info(missing, raise_errors=True)
+            else:
+                info = utils.steam.get_apps_info(missing, raise_errors=True)
+
+            stored = []
+            for item_id in info:
+                value = utils.serializer.dumps({str(item_id): info[item_id]})
+                stored.append((item_id, value, info[item_id].get("_change_number", 0)))
+
+                # persist writes the manifest entries of the values it stored
+                items[item_id] = (item_id, value, None)
+
+            utils.cache.persist(kind, stored)
+
+        yield len(batch), list(items.values())
+
+
+def stored_item(item_id, content):
+    """
+    Return the id, value and change number of the
+    content of an app or package read from storage.
+    """
+
+    value = content.encode("utf-8")
+
+    return item_id, value, utils.cache.change_number(value)
+
+
+def warm(kind, batches, checkpoint, position, expiration=0):
+    """
+    Write the batches of ids, values and change numbers to
+    the cache with one pipeline per batch, expiring after
+    expiration seconds or never when 0, rebuild the storage
+    manifest of the values read from storage and keep track
+    of the position in the checkpoint file.
+    """
+
+    started = time.monotonic()
+    count = 0
+    size = 0
+
+    for read, items in batches:
+        now = int(time.time())
+        modified, entries = manifest_entries(kind, items, now)
+        data = {}
+
+        for item_id, value, _ in items:
+            data.update(
+                utils.cache.encode_value(
+                    kind, item_id, value, modified.get(item_id, now)
+                )
+            )
+            size += len(value)
+
+        if data and not utils.cache.write(kind, data, expiration):
+            raise Exception("Failed to write batch to the cache")
+
+        if not utils.redis.write_fields(utils.cache.MANIFEST + kind, entries):
+            raise Exception("Failed to write batch to the storage manifest")
+
+        utils.cache.invalidate([kind + "." + str(item_id) for item_id, _, _ in items])
+
+        # the position only passes batches that have been written
+        count += len(items)
+        position += read
+        write_checkpoint(checkpoint, position)
+
+        duration = max(time.monotonic() - started, 0.001)
+        logger.info(
+            "Warmed up "
+            + str(count)
+            + " "
+            + kind
+            + "s at "
+            + str(round(count / duration))
+            + " per second and "
+            + str(round(size / duration / 1000000, 1))
+            + " MB per second",
+            extra={"position": position},
+        )
+
+    return count
+
+
+def manifest_entries(kind, items, now):
+    """
+    Return the modification timestamps in the manifest of the
+    values read from storage that have not changed, and the
+    new manifest entries, modified now, of the others.
+    """
+
+    stored = [item for item in items if item[2] is not None]
+
+    if config.storage != "True" or not stored:
+        return {}, {}
+
+    manifest = utils.redis.read_fields(
+        utils.cache.MANIFEST + kind, [str(item_id) for item_id, _, _ in stored]
+    )
+
+    if manifest is False:
+        raise Exception("Failed to read the storage manifest")
+
+    modified = {}
+    entries = {}
+    for (item_id, value, change_number), entry in zip(stored, manifest, strict=True):
+        content_hash = utils.cache.digest(value)
+
+        if entry and entry.split(":")[0] == content_hash:
+            timestamp = utils.cache.manifest_modified(entry)
+
+            if timestamp is not None:
+                modified[item_id] = timestamp
+                continue
+
+        entries[str(item_id)] = ":".join([content_hash, str(change_number), str(now)])
+
+    return modified, entries
+
+
+def read_checkpoint(checkpoint, source):
+    """
+    Return the position to resume the source from,
+    or 0 when there is no checkpoint of the source.
+    """
+
+    if not checkpoint or not os.path.exists(checkpoint):
+        return 0
+
+    with open(checkpoint) as file:
+        state = json.load(file)
+
+    if state["source"] != source:
+        return 0
+
+    return state["position"]
+
+
+def write_checkpoint(checkpoint, position):
+    """
+    Store the position of the source in the
+    checkpoint file.
+    """
+
+    if not checkpoint:
+        return
+
+    with open(checkpoint) as file:
+        state = json.load(file)
+
+    state["position"] = position
+
+    with open(checkpoint + ".tmp", "w") as file:
+        json.dump(state, file)
+
+    os.replace(checkpoint + ".tmp", checkpoint)
+
+
+def main():
+    """
+    Parse the arguments and warm up the
+    cache from the selected source.
+    """
+
+    parser = argparse.ArgumentParser(description="Preload the cache.")
+    parser.add_argument("source", choices=["storage", "snapshot", "hot"])
+    parser.add_argument("file", nargs="?", help="snapshot or hot ids file")
+    parser.add_argument("--kind", choices=["app", "package"], default="app")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=int(config.storage_workers))
+    parser.add_argument("--checkpoint", help="file to resume from")
+    parser.add_argument(
+        "--expiration",
+        type=int,
+        default=0,
+        help="seconds until the preloaded values expire, 0 for never",
+    )
+    args = parser.parse_args()
+
+    # storage reads run on the storage threads
+    utils.storage.executor(args.workers)
+
+    if args.source != "storage" and not args.file:
+        parser.error("the " + args.source + " source requires a file")
+
+    source = ":".join([args.source, args.kind, args.file or ""])
+    position = read_checkpoint(args.checkpoint, source)
+
+    if args.checkpoint:
+        with open(args.checkpoint, "w") as file:
+            json.dump({"source": source, "position": position}, file)
+
+    if position:
+        logger.info("Resuming warm-up", extra={"position": position})
+
+    match args.source:
+        case "storage":
+            batches = storage_batches(args.kind, position, args.batch_size)
+        case "snapshot":
+            batches = snapshot_batches(args.file, position, args.batch_size)
+        case "hot":
+            batches = hot_batches(args.kind, args.file, position, args.batch_size)
+
+    count = warm(args.kind, batches, args.checkpoint, position, args.expiration)
+
+    if args.checkpoint:
+        os.remove(args.checkpoint)
+
+    logger.info("Finished warm-up of " + str(count) + " " + args.kind + "s")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,39 @@ Web Service and main API.
 """
 
 # import modules
+import utils.cache
 import utils.redis
+import utils.serializer
 import utils.steam
 import config
-import json
+import asyncio
 import semver
 import typing
 import logging
-from fastapi import FastAPI, Response
+from email.utils import formatdate, parsedate_to_datetime
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # log in the steam sessions before the first request
+    utils.steam.start_sessions()
+
+    if config.cache == "True":
+        listener = asyncio.create_task(utils.cache.listen())
+
+    yield
+
+    if config.cache == "True":
+        listener.cancel()
+
+    await utils.redis.get_async_pool().disconnect()
+
 
 # initialise app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 # include "pretty" for backwards compatibility
@@ -24,55 +46,487 @@ class PrettyJSONResponse(Response):
         # check if pretty print enabled
         if content["pretty"]:
             del content["pretty"]
-            return json.dumps(content, indent=4, sort_keys=True).encode("utf-8")
+            return utils.serializer.dumps(content, pretty=True)
 
         else:
             del content["pretty"]
-            return json.dumps(content, sort_keys=True).encode("utf-8")
+            return utils.serializer.dumps(content)
 
 
-@app.get("/v1/info/{app_id}", response_class=PrettyJSONResponse)
-def read_app(app_id: int, pretty: bool = False):
-    logging.info("Requested app info", extra={"apps": str([app_id])})
+def accepts_gzip(request: Request) -> bool:
+    """
+    Check if the client accepts gzip encoded responses. An
+    explicit gzip entry takes precedence over the wildcard.
+    """
+
+    qualities = {}
+
+    for encoding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = encoding.partition(";")
+        quality = 1.0
+
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        qualities[name.strip().lower()] = quality
+
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def cache_headers(meta) -> dict:
+    """
+    Return the validator headers of a cached app
+    from its metadata.
+    """
+
+    etag, modified = utils.cache.parse_meta(meta)
+
+    if not etag:
+        return {}
+
+    return {"ETag": etag, "Last-Modified": formatdate(modified, usegmt=True)}
+
+
+def not_modified(request: Request, meta) -> bool:
+    """
+    Check if the cached app the client already has is
+    still current according to the If-None-Match or
+    If-Modified-Since request headers.
+    """
+
+    etag, modified = utils.cache.parse_meta(meta)
+
+    if not etag:
+        return False
+
+    # If-Modified-Since is ignored when If-None-Match is sent
+    if "if-none-match" in request.headers:
+        for tag in request.headers["if-none-match"].split(","):
+            tag = tag.strip()
+            if tag == "*" or tag.removeprefix("W/") == etag.removeprefix("W/"):
+                return True
+
+        return False
+
+    if "if-modified-since" in request.headers:
+        try:
+            since = parsedate_to_datetime(request.headers["if-modified-since"])
+            return modified <= since.timestamp()
+
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def not_modified_response(meta) -> Response:
+    """
+    Return an empty 304 Not Modified response
+    with the validators of a cached app.
+    """
+
+    headers = {"Vary": "Accept-Encoding", **cache_headers(meta)}
+
+    return Response(status_code=304, headers=headers)
+
+
+def serialized_response(
+    request: Request, body: bytes, compressed=False, pretty: bool = False, meta=False
+) -> Response:
+    """
+    Return a pre-serialized response body as is, gzip
+    compressed if available and accepted by the client,
+    or pretty printed when requested.
+    """
+
+    headers = cache_headers(meta)
+
+    # pretty printing is rare so it is fine to parse the body again
+    if pretty:
+        content = utils.serializer.dumps(utils.serializer.loads(body), pretty=True)
+        return Response(content, media_type="application/json", headers=headers)
+
+    headers["Vary"] = "Accept-Encoding"
+
+    if compressed and accepts_gzip(request):
+        headers["Content-Encoding"] = "gzip"
+        return Response(compressed, media_type="application/json", headers=headers)
+
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def read_cached(request: Request, kind: str, item_id: int, pretty: bool):
+    """
+    Return the response of a single app or package from
+    the local cache, Redis or Steam in that order.
+    """
+
+    name = kind.capitalize()
+    extra = {kind + "s": str([item_id])}
+
+    compressed = False
+    meta = False
+    status = "success"
+    conditional = (
+        "if-none-match" in request.headers or "if-modified-since" in request.headers
+    )
 
     if config.cache == "True":
-        info = utils.redis.read("app." + str(app_id))
+        keys = utils.cache.cache_keys(kind, item_id)
+        cached = utils.cache.local_read(keys[0])
 
-        if not info:
+        if cached is not None:
+            value, compressed, meta = cached
             logging.info(
-                "App info could not be found in cache", extra={"apps": str([app_id])}
+                name + " info succesfully retrieved from local cache", extra=extra
             )
-            info = utils.steam.get_apps_info([app_id])
-            data = json.dumps(info)
-            utils.redis.write("app." + str(app_id), data)
+
         else:
-            info = json.loads(info)
-            logging.info(
-                "App info succesfully retrieved from cache",
-                extra={"apps": str([app_id])},
-            )
+            # validate conditional requests without loading the info
+            if conditional:
+                metas, ttls = await utils.redis.async_read_with_ttl(keys[2:])
+
+                if not_modified(request, metas[0]):
+                    logging.info(name + " info has not been modified", extra=extra)
+                    if utils.redis.is_stale(ttls[0]):
+                        utils.cache.refresh(kind, item_id)
+
+                    return not_modified_response(metas[0])
+
+            values, ttls = await utils.redis.async_read_with_ttl(keys)
+            value, compressed, meta = values
+
+            if not value:
+                logging.info(name + " info could not be found in cache", extra=extra)
+                value, compressed, meta = await utils.cache.fetch(kind, item_id)
+            else:
+                logging.info(
+                    name + " info succesfully retrieved from cache", extra=extra
+                )
+
+                if utils.redis.is_stale(ttls[0]):
+                    utils.cache.refresh(kind, item_id)
+
+                    # flag stale info while Steam is unavailable
+                    if await utils.steam.async_circuit_open():
+                        status = "stale"
+                        compressed = False
+
+                elif value != b"false":
+                    utils.cache.local_write(keys[0], (value, compressed, meta))
 
     else:
-        info = utils.steam.get_apps_info([app_id])
+        value, compressed, meta = await utils.cache.fetch(kind, item_id)
+
+    if conditional and not_modified(request, meta):
+        logging.info(name + " info has not been modified", extra=extra)
+        return not_modified_response(meta)
 
-    if info is None:
+    if value is False:
         logging.info(
-            "The SteamCMD backend returned no actual data and failed",
-            extra={"apps": str([app_id])},
+            "The SteamCMD backend is unavailable and the request failed",
+            extra=extra,
         )
-        # return empty result for not found app
-        return {"data": {app_id: {}}, "status": "failed", "pretty": pretty}
+        status = "failed"
+    elif utils.cache.item_data(item_id, value) == b"{}":
+        logging.info(
+            "No " + kind + " has been found at Steam but the request was succesfull",
+            extra=extra,
+        )
+    else:
+        logging.info("Succesfully retrieved " + kind + " info", extra=extra)
+
+    body = utils.cache.response_body({item_id: value}, status)
+
+    return serialized_response(request, body, compressed, pretty, meta)
+
+
+async def read_cached_many(request: Request, kind: str, ids: str, pretty: bool):
+    """
+    Return the response of a comma separated list of apps
+    or packages, reading all cached items at once and
+    fetching all missing items with a single request.
+    """
+
+    try:
+        # remove duplicates while keeping the order
+        item_ids = [int(item_id) for item_id in ids.split(",") if item_id.strip()]
+        item_ids = list(dict.fromkeys(item_ids))
+
+    except ValueError:
+        item_ids = []
+
+    if not item_ids or len(item_ids) > int(config.batch_size):
+        logging.info(
+            "Requested " + kind + " info with invalid list of " + kind + "s",
+            extra={"ids": ids},
+        )
+        return {
+            "status": "error",
+            "data": "The ids parameter must be a comma separated list of 1 to "
+            + str(config.batch_size)
+            + " "
+            + kind
+            + " ids",
+            "pretty": pretty,
+        }
+
+    extra = {kind + "s": str(item_ids)}
+    logging.info("Requested " + kind + " info", extra=extra)
+
+    values = {}
+    missing = item_ids
+    status = "success"
+
+    if config.cache == "True":
+        uncached = []
+        for item_id in item_ids:
+            cached = utils.cache.local_read(kind + "." + str(item_id))
+
+            if cached is None:
+                uncached.append(item_id)
+            else:
+                values[item_id] = cached[0]
+
+        # read the whole cache entries so they can be kept in the local cache
+        keys = [
+            key for item_id in uncached for key in utils.cache.cache_keys(kind, item_id)
+        ]
+        cached_values, ttls = await utils.redis.async_read_with_ttl(keys)
+
+        missing = []
+        stale = False
+        for i, item_id in enumerate(uncached):
+            value, compressed, meta = cached_values[i * 3 : i * 3 + 3]
+
+            if not value:
+                missing.append(item_id)
+                continue
+
+            values[item_id] = value
+
+            if utils.redis.is_stale(ttls[i * 3]):
+                utils.cache.refresh(kind, item_id)
+                stale = True
+
+            elif value != b"false":
+                utils.cache.local_write(keys[i * 3], (value, compressed, meta))
+
+        # flag stale info while Steam is unavailable
+        if stale and await utils.steam.async_circuit_open():
+            status = "stale"
 
-    if not info:
         logging.info(
-            "No app has been found at Steam but the request was succesfull",
-            extra={"apps": str([app_id])},
+            kind.capitalize()
+            + " info of "
+            + str(len(item_ids) - len(missing))
+            + " "
+            + kind
+            + "s succesfully retrieved from cache",
+            extra=extra,
         )
-        # return empty result for not found app
-        return {"data": {app_id: {}}, "status": "success", "pretty": pretty}
 
-    logging.info("Succesfully retrieved app info", extra={"apps": str([app_id])})
-    return {"data": info, "status": "success", "pretty": pretty}
+    if missing:
+        fetched = await utils.cache.fetch_many(kind, missing)
+
+        if fetched is False:
+            logging.info(
+                "The SteamCMD backend returned no actual data and failed",
+                extra={kind + "s": str(missing)},
+            )
+            status = "failed"
+            fetched = {}
+
+        for item_id in missing:
+            values[item_id] = fetched.get(item_id, False)
+
+    body = utils.cache.response_body(values, status)
+
+    return serialized_response(request, body, pretty=pretty)
+
+
+@app.get("/v1/info/{app_id}", response_class=PrettyJSONResponse)
+async def read_app(request: Request, app_id: int, pretty: bool = False):
+    logging.info("Requested app info", extra={"apps": str([app_id])})
+
+    return await read_cached(request, "app", app_id, pretty)
+
+
+@app.get("/v1/info", response_class=PrettyJSONResponse)
+async def read_apps(request: Request, ids: str, pretty: bool = False):
+    return await read_cached_many(request, "app", ids, pretty)
+
+
+@app.get("/v1/package/{package_id}", response_class=PrettyJSONResponse)
+async def read_package(request: Request, package_id: int, pretty: bool = False):
+    logging.info("Requested package info", extra={"packages": str([package_id])})
+
+    return await read_cached(request, "package", package_id, pretty)
+
+
+@app.get("/v1/package", response_class=PrettyJSONResponse)
+async def read_packages(request: Request, ids: str, pretty: bool = False):
+    return await read_cached_many(request, "package", ids, pretty)
+
+
+@app.get("/v1/changes", response_class=PrettyJSONResponse)
+async def read_changes(since: int, limit: int = 100, pretty: bool = False):
+    logging.info("Requested changes", extra={"since": since, "limit": limit})
+
+    if limit < 1 or limit > int(config.batch_size):
+        return {
+            "status": "error",
+            "data": "The limit parameter must be between 1 and "
+            + str(config.batch_size),
+            "pretty": pretty,
+        }
+
+    # read one extra change to know if there are more pages
+    entries = await utils.redis.async_read_log(utils.cache.CHANGE_LOG, since, limit + 1)
+
+    if entries is False:
+        return {
+            "status": "failed",
+            "data": "Something went wrong while retrieving the changes. Please try again later",
+            "pretty": pretty,
+        }
+
+    changes = [utils.serializer.loads(entry) for entry in entries[:limit]]
+
+    return {
+        "status": "success",
+        "data": {
+            "changes": changes,
+            "change_number": changes[-1]["change_number"] if changes else since,
+            "more": len(entries) > limit,
+        },
+        "pretty": pretty,
+    }
+
+
+def change_event(change: dict, apps: set, packages: set) -> bytes:
+    """
+    Format a change as server-sent event, limited to the
+    apps and packages of the filters if any is set. Returns
+    None when none of the filtered apps or packages changed.
+    """
+
+    if apps or packages:
+        matched_apps = [app_id for app_id in change["apps"] if app_id in apps]
+        matched_packages = [
+            package_id for package_id in change["packages"] if package_id in packages
+        ]
+        if not matched_apps and not matched_packages:
+            return None
+
+        change = {**change, "apps": matched_apps, "packages": matched_packages}
+
+    return (
+        b"id: "
+        + str(change["change_number"]).encode("utf-8")
+        + b"\nevent: change\ndata: "
+        + utils.serializer.dumps(change)
+        + b"\n\n"
+    )
+
+
+async def change_events(since, apps: set, packages: set, keepalive=15):
+    """
+    Subscribe to changes and yield the logged changes after
+    since followed by the changes pushed to the subscriber.
+    """
+
+    # subscribe before reading the change log so no change is missed, and
+    # only once the response has started so the finally always unsubscribes
+    queue = utils.cache.subscribe()
+
+    try:
+        # catch up from the change log before streaming live changes
+        while since is not None:
+            entries = await utils.redis.async_read_log(
+                utils.cache.CHANGE_LOG, since, config.batch_size
+            )
+
+            for entry in entries or []:
+                change = utils.serializer.loads(entry)
+                since = change["change_number"]
+                event = change_event(change, apps, packages)
+                if event:
+                    yield event
+
+            if not entries or len(entries) < int(config.batch_size):
+                break
+
+        while True:
+            try:
+                change = await asyncio.wait_for(queue.get(), keepalive)
+
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+
+            # the subscriber lagged behind or the subscription was lost
+            if change is None:
+                yield b"event: reset\ndata: {}\n\n"
+                break
+
+            if since is not None and change["change_number"] <= since:
+                continue
+
+            event = change_event(change, apps, packages)
+            if event:
+                yield event
+
+    finally:
+        utils.cache.unsubscribe(queue)
+
+
+@app.get("/v1/changes/stream", response_class=PrettyJSONResponse)
+async def stream_changes(
+    request: Request,
+    apps: str = "",
+    packages: str = "",
+    since: typing.Optional[int] = None,
+):
+    logging.info(
+        "Requested change stream",
+        extra={"apps": apps, "packages": packages, "since": since},
+    )
+
+    # resume from the last received change when reconnecting
+    if request.headers.get("last-event-id", "").isdigit():
+        since = int(request.headers["last-event-id"])
+
+    try:
+        app_ids = {int(app_id) for app_id in apps.split(",") if app_id.strip()}
+        package_ids = {
+            int(package_id) for package_id in packages.split(",") if package_id.strip()
+        }
+
+    except ValueError:
+        return {
+            "status": "error",
+            "data": "The apps and packages parameters must be comma separated lists of ids",
+            "pretty": False,
+        }
+
+    if config.cache != "True":
+        return {
+            "status": "error",
+            "data": "The change stream is not available without cache",
+            "pretty": False,
+        }
+
+    return StreamingResponse(
+        change_events(since, app_ids, package_ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/v1/version", response_class=PrettyJSONResponse)
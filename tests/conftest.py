@@ -0,0 +1,93 @@
+"""
+Shared fixtures of the tests. The source modules are imported
+from src/ with Redis replaced by fakeredis.
+
+Run from the repository root:
+python -m pytest tests
+"""
+
+# import modules
+import os
+import sys
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+sys.path.insert(0, SOURCE)
+os.chdir(SOURCE)
+os.environ["CACHE"] = "True"
+
+import fakeredis  # noqa: E402
+import pytest  # noqa: E402
+import utils.cache  # noqa: E402
+import utils.redis  # noqa: E402
+import utils.storage  # noqa: E402
+
+
+class FakeAsyncPool:
+    async def disconnect(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def redis(monkeypatch):
+    """
+    Replace the Redis connections of utils.redis with an
+    empty fakeredis server and return a client of it.
+    """
+
+    server = fakeredis.FakeServer()
+
+    monkeypatch.setattr(
+        utils.redis, "connect", lambda: fakeredis.FakeRedis(server=server)
+    )
+    monkeypatch.setattr(
+        utils.redis, "async_connect", lambda: fakeredis.FakeAsyncRedis(server=server)
+    )
+    monkeypatch.setattr(utils.redis, "get_async_pool", lambda: FakeAsyncPool())
+
+    # the in-process cache must not leak between tests
+    utils.cache._local.clear()
+
+    return fakeredis.FakeRedis(server=server)
+
+
+@pytest.fixture
+def steam(monkeypatch):
+    """
+    Serve app and package info from a dict instead of Steam
+    and return it, with a list of the requested ids.
+    """
+
+    info = {"apps": {}, "packages": {}, "requests": []}
+
+    async def get_info(kind, item_ids, background=False, raise_errors=False):
+        info["requests"].append(item_ids)
+        items = info[kind + "s"]
+
+        if items is False and raise_errors:
+            raise Exception("Failed to retrieve " + kind + " info")
+
+        if items is False:
+            return False
+
+        return {item_id: items[item_id] for item_id in item_ids if item_id in items}
+
+    monkeypatch.setattr(utils.cache, "get_info", get_info)
+
+    return info
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    """
+    Enable local storage in a temporary directory
+    and return the path of the stored items.
+    """
+
+    # the storage directory is relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils.cache.config, "storage", "True")
+    monkeypatch.setattr(utils.storage.config, "storage_type", "local")
+    monkeypatch.setattr(utils.storage.config, "storage_directory", "data/")
+
+    return tmp_path / "data"
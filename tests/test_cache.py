@@ -0,0 +1,159 @@
+"""
+Tests of the encoding of cached values and response bodies
+and of fetching them from Steam.
+"""
+
+# import modules
+import asyncio
+import concurrent.futures
+import gzip
+import json
+import threading
+import utils.cache
+import utils.redis
+import utils.serializer
+import utils.steam
+
+
+def test_encode_writes_all_keys():
+    data = utils.cache.encode("app", 10, {10: {"common": {"name": "x" * 2000}}})
+
+    assert set(data) == {"app.10", "app.10.gz", "app.10.meta"}
+    assert gzip.decompress(data["app.10.gz"]) == utils.cache.response_body(
+        {10: data["app.10"]}
+    )
+
+
+def test_encode_clears_compressed_body_of_small_value():
+    assert utils.cache.encode("app", 10, {10: {"common": {}}})["app.10.gz"] == b""
+    assert utils.cache.encode("app", 10, False)["app.10.gz"] == b""
+
+
+def test_smaller_value_replaces_compressed_body(redis):
+    utils.redis.write_many(utils.cache.encode("app", 10, {10: {"x": "y" * 2000}}))
+    utils.redis.write_many(utils.cache.encode("app", 10, False))
+
+    assert redis.get("app.10") == b"false"
+    assert redis.get("app.10.gz") == b""
+    assert redis.ttl("app.10") == redis.ttl("app.10.gz")
+
+
+def test_response_body_equals_json_dumps():
+    items = {
+        100: utils.serializer.dumps({"100": {"b": 1, "a": [1, 2]}}),
+        20: utils.serializer.dumps({"20": {"common": {"name": "é"}}}),
+        3: b"false",
+    }
+
+    expected = json.dumps(
+        {
+            "data": {100: {"a": [1, 2], "b": 1}, 20: {"common": {"name": "é"}}, 3: {}},
+            "status": "success",
+        },
+        sort_keys=True,
+    )
+
+    assert utils.cache.response_body(items) == expected.encode("utf-8")
+
+
+def test_response_body_sorts_ids_numerically():
+    items = {item_id: b"false" for item_id in (100, 20, 3)}
+
+    assert utils.cache.response_body(items, "failed") == (
+        b'{"data": {"3": {}, "20": {}, "100": {}}, "status": "failed"}'
+    )
+
+
+def test_item_data():
+    assert utils.cache.item_data(5, b'{"5": {"a": 1}}') == b'{"a": 1}'
+    assert utils.cache.item_data(5, b"false") == b"{}"
+    assert utils.cache.item_data(5, False) == b"{}"
+
+
+def test_local_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(utils.cache.config, "cache_local_size", "2")
+
+    utils.cache.local_write("a", 1)
+    utils.cache.local_write("b", 2)
+    utils.cache.local_read("a")
+    utils.cache.local_write("c", 3)
+
+    assert utils.cache.local_read("b") is None
+    assert utils.cache.local_read("a") == 1
+    assert utils.cache.local_read("c") == 3
+
+
+def test_item_data_of_package_in_old_format():
+    assert utils.cache.item_data(5, b'{"packageid": 5}') == b'{"packageid": 5}'
+    assert utils.cache.item_data(5, b"{}") == b"{}"
+
+
+def test_half_open_circuit_lets_one_fetch_probe(monkeypatch, redis):
+    redis.hset(utils.steam.CIRCUIT_KEY, mapping={"failures": 5, "opened": 0})
+
+    def request(func, *args, timeout=3):
+        # answer later so the other fetch checks the circuit meanwhile
+        future = concurrent.futures.Future()
+        threading.Timer(0.1, future.set_result, [func(None, *args)]).start()
+        return future
+
+    monkeypatch.setattr(utils.steam, "request", request)
+    monkeypatch.setattr(
+        utils.steam, "_apps_info", lambda client, apps: {apps[0]: {"appid": apps[0]}}
+    )
+
+    async def fetch_both():
+        return await asyncio.gather(
+            utils.cache.fetch("app", 10), utils.cache.fetch("app", 11)
+        )
+
+    entries = asyncio.run(fetch_both())
+
+    # the other fetch fails fast without caching the failure
+    assert sorted(bool(entry[0]) for entry in entries) == [False, True]
+    assert redis.exists("app.10", "app.11") == 1
+    assert not redis.exists(utils.steam.CIRCUIT_KEY)
+
+
+def test_concurrent_fetches_request_steam_once(steam):
+    steam["apps"][10] = {"appid": 10}
+
+    async def fetch_all():
+        return await asyncio.gather(*(utils.cache.fetch("app", 10) for _ in range(5)))
+
+    entries = asyncio.run(fetch_all())
+
+    assert steam["requests"] == [[10]]
+    assert {entry[0] for entry in entries} == {b'{"10": {"appid": 10}}'}
+
+
+def test_fetch_waits_for_other_worker(steam, redis):
+    steam["apps"][10] = {"appid": 10}
+    redis.set("lock.app.10", "other")
+
+    async def fetch_while_written():
+        async def write():
+            await asyncio.sleep(0.15)
+            data = utils.cache.encode("app", 10, {10: {"appid": 10}})
+            await utils.cache.async_write("app", data)
+
+        entry, _ = await asyncio.gather(utils.cache.fetch("app", 10), write())
+        return entry
+
+    entry = asyncio.run(fetch_while_written())
+
+    assert steam["requests"] == []
+    assert entry[0] == b'{"10": {"appid": 10}}'
+
+
+def test_fetch_after_waiting_for_other_worker(steam, redis, monkeypatch):
+    steam["apps"][10] = {"appid": 10}
+    redis.set("lock.app.10", "other")
+    monkeypatch.setattr(utils.cache.config, "cache_lock_wait", "0.2")
+
+    entry = asyncio.run(utils.cache.fetch("app", 10))
+
+    # the lock of the other worker is left alone
+    assert steam["requests"] == [[10]]
+    assert entry[0] == b'{"10": {"appid": 10}}'
+    assert redis.get("lock.app.10") == b"other"
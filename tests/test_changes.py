@@ -0,0 +1,133 @@
+"""
+Tests of the change log and change stream.
+"""
+
+# import modules
+import asyncio
+import pytest
+import utils.cache
+import utils.redis
+import utils.serializer
+import web
+from fastapi.testclient import TestClient
+
+
+def log_change(change_number, apps=[], packages=[]):
+    change = {
+        "change_number": change_number,
+        "previous_change_number": change_number - 1,
+        "apps": apps,
+        "packages": packages,
+    }
+    utils.redis.append_log(
+        utils.cache.CHANGE_LOG, change_number, utils.serializer.dumps(change), 100
+    )
+
+    return change
+
+
+async def collect(events, count):
+    return [await anext(events) for _ in range(count)]
+
+
+def test_changes_are_paginated():
+    for change_number in (10, 11, 12):
+        log_change(change_number, apps=[change_number])
+
+    client = TestClient(web.app)
+    first = client.get("/v1/changes?since=9&limit=2").json()["data"]
+    second = client.get("/v1/changes?since=" + str(first["change_number"])).json()
+
+    assert [change["apps"] for change in first["changes"]] == [[10], [11]]
+    assert first["more"] is True
+    assert second["data"]["changes"][0]["change_number"] == 12
+    assert second["data"]["more"] is False
+
+
+def test_stream_resumes_from_log_and_filters():
+    log_change(10, apps=[1], packages=[5])
+    log_change(11, apps=[2])
+    log_change(12, apps=[1, 2], packages=[6])
+
+    async def run():
+        events = web.change_events(10, {2}, {6})
+        received = await collect(events, 2)
+        await events.aclose()
+
+        return received
+
+    first, second = asyncio.run(run())
+
+    assert first.startswith(b"id: 11\nevent: change\ndata: ")
+    assert utils.serializer.loads(second.split(b"data: ")[1]) == {
+        "change_number": 12,
+        "previous_change_number": 11,
+        "apps": [2],
+        "packages": [6],
+    }
+
+
+def test_stream_skips_live_changes_already_replayed():
+    log_change(10, apps=[1])
+
+    async def run():
+        events = web.change_events(9, set(), set())
+        replayed = await anext(events)
+        live = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0)
+
+        utils.cache.dispatch(log_change(10, apps=[1]))
+        utils.cache.dispatch(log_change(11, apps=[2]))
+        received = await live
+        await events.aclose()
+
+        return replayed, received
+
+    replayed, live = asyncio.run(run())
+
+    assert replayed.startswith(b"id: 10\n")
+    assert live.startswith(b"id: 11\n")
+
+
+def test_stream_subscribes_only_while_running():
+    async def run():
+        events = web.change_events(None, set(), set())
+        before = len(utils.cache._subscribers)
+
+        live = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0)
+        during = len(utils.cache._subscribers)
+
+        live.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await live
+        await events.aclose()
+
+        return before, during, len(utils.cache._subscribers)
+
+    assert asyncio.run(run()) == (0, 1, 0)
+
+
+def test_lagging_subscriber_is_reset(monkeypatch):
+    monkeypatch.setattr(web.config, "stream_queue_size", "1")
+
+    async def run():
+        events = web.change_events(None, set(), set())
+        live = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0)
+
+        utils.cache.dispatch(log_change(10))
+        first = await live
+
+        # the second change fills the queue, the third overflows it
+        utils.cache.dispatch(log_change(11))
+        utils.cache.dispatch(log_change(12))
+        rest = [event async for event in events]
+
+        return first, rest
+
+    first, rest = asyncio.run(run())
+
+    assert first.startswith(b"id: 10\n")
+    assert rest == [b"event: reset\ndata: {}\n\n"]
+    assert not utils.cache._subscribers
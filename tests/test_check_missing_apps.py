@@ -0,0 +1,55 @@
+"""
+Tests of the check_missing_apps task.
+"""
+
+# import modules
+import pytest
+import utils.cache
+import utils.redis
+import utils.steam
+from tasks import check_missing_apps
+
+
+@pytest.fixture
+def dispatched(monkeypatch):
+    """
+    Serve a fixed Steam app list and return the list of
+    app chunks that get_app_info tasks were started for.
+    """
+
+    chunks = []
+
+    monkeypatch.setattr(utils.steam, "iter_app_list", lambda: iter(range(1, 7)))
+    monkeypatch.setattr(check_missing_apps.config, "storage", "False")
+    monkeypatch.setattr(
+        check_missing_apps.get_app_info_task,
+        "apply_async",
+        lambda args, countdown: chunks.append(args[0]),
+    )
+
+    return chunks
+
+
+def test_present_apps_are_not_requested(dispatched, redis):
+    utils.cache.write("app", utils.cache.encode("app", 1, {1: {"appid": 1}}))
+    redis.set("package.2", b"{}")
+    redis.hset(utils.cache.MANIFEST + "app", "3", "x:0")
+    redis.zadd(utils.cache.INCORRECT_APPS, {"4": 0})
+
+    check_missing_apps.check_missing_apps_task.run()
+
+    assert sorted(app_id for chunk in dispatched for app_id in chunk) == [2, 5, 6]
+    assert not redis.exists(
+        check_missing_apps.STEAM_APPS,
+        check_missing_apps.PRESENT_APPS,
+        check_missing_apps.MISSING_APPS,
+    )
+
+
+def test_expired_apps_are_not_requested_again(dispatched, redis):
+    utils.cache.write("app", utils.cache.encode("app", 1, {1: {"appid": 1}}))
+    redis.delete("app.1", "app.1.gz", "app.1.meta")
+
+    check_missing_apps.check_missing_apps_task.run()
+
+    assert 1 not in [app_id for chunk in dispatched for app_id in chunk]
@@ -0,0 +1,65 @@
+"""
+Tests of the get_app_info task.
+"""
+
+# import modules
+import pytest
+import utils.cache
+import utils.steam
+from tasks import get_app_info
+
+
+@pytest.fixture
+def call(monkeypatch):
+    """
+    Replace the Steam requests by a function that raises
+    the exception set in the returned dict.
+    """
+
+    failure = {"error": None}
+
+    def call(func, *args, timeout=3, background=True):
+        raise failure["error"]
+
+    monkeypatch.setattr(utils.steam, "call", call)
+
+    return failure
+
+
+def test_timeout_halves_chunk_size(call):
+    get_app_info.write_chunk_size(40)
+    call["error"] = Exception("Max connect retries (2) exceeded")
+
+    with pytest.raises(Exception):
+        get_app_info.get_app_info_task.run([1, 2])
+
+    assert get_app_info.chunk_size() == 20
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "Circuit breaker of Steam requests is open",
+        "Rate limit of Steam requests exceeded",
+    ],
+)
+def test_unavailable_keeps_chunk_size(call, message):
+    get_app_info.write_chunk_size(40)
+    call["error"] = utils.steam.Unavailable(message)
+
+    with pytest.raises(utils.steam.Unavailable):
+        get_app_info.get_app_info_task.run([1, 2])
+
+    assert get_app_info.chunk_size() == 40
+
+
+def test_missing_apps_are_scheduled(monkeypatch, redis):
+    monkeypatch.setattr(
+        utils.steam, "call", lambda func, *args, **kwargs: {1: {"appid": 1}}
+    )
+    redis.zadd(utils.cache.INCORRECT_APPS, {"1": 0})
+
+    get_app_info.get_app_info_task.run([1, 2])
+
+    assert redis.get("app.1") == b'{"1": {"appid": 1}}'
+    assert redis.zrange(utils.cache.INCORRECT_APPS, 0, -1) == [b"2"]
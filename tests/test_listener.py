@@ -0,0 +1,103 @@
+"""
+Tests of the listener service and its hand-over with the job service.
+"""
+
+# import modules
+import listener
+import pytest
+import utils.cache
+import utils.steam
+from tasks import check_changelist
+
+
+@pytest.fixture
+def changes(monkeypatch):
+    """
+    Return the changes since the change number 40 and
+    record the dispatched changes instead of queueing tasks.
+    """
+
+    dispatched = []
+    result = {"change_number": 40, "apps": [], "packages": []}
+
+    monkeypatch.setattr(utils.steam, "get_change_number", lambda: 40)
+    monkeypatch.setattr(
+        utils.steam, "get_changes_since_change_number", lambda since: dict(result)
+    )
+    monkeypatch.setattr(
+        listener, "dispatch_changes", lambda *args: dispatched.append(args)
+    )
+    monkeypatch.setattr(
+        check_changelist, "dispatch_changes", lambda *args: dispatched.append(args)
+    )
+
+    return result, dispatched
+
+
+def test_poll_backs_off_until_changed(redis, changes):
+    result, dispatched = changes
+    redis.set("_state.change_number", 40)
+
+    assert listener.poll(1.0) == (1.5, True)
+    assert listener.poll(4.0) == (5.0, True)
+
+    result.update({"change_number": 41, "apps": [1]})
+
+    assert listener.poll(5.0) == (1.0, True)
+    assert dispatched[0][:2] == ("40", 41)
+
+
+def test_failed_poll_is_reported(redis, monkeypatch):
+    redis.set("_state.change_number", 40)
+    monkeypatch.setattr(
+        utils.steam, "get_changes_since_change_number", lambda since: False
+    )
+
+    assert listener.poll(1.0) == (5.0, False)
+
+    redis.delete("_state.change_number")
+    monkeypatch.setattr(utils.steam, "get_change_number", lambda: False)
+
+    assert listener.poll(1.0) == (5.0, False)
+
+
+def test_listener_only_marks_successful_polls(redis, monkeypatch):
+    results = iter([(1.0, True), (5.0, False)])
+
+    def poll(interval):
+        redis.delete(utils.cache.LISTENER)
+        return next(results)
+
+    def sleep(interval):
+        if interval == 5.0:
+            raise KeyboardInterrupt
+        assert redis.exists(utils.cache.LISTENER)
+
+    monkeypatch.setattr(utils.steam, "start_sessions", lambda pool_size: None)
+    monkeypatch.setattr(listener, "poll", poll)
+    monkeypatch.setattr(listener.time, "sleep", sleep)
+
+    with pytest.raises(KeyboardInterrupt):
+        listener.main()
+
+    assert not redis.exists(utils.cache.LISTENER)
+
+
+def test_job_skips_changes_while_listener_is_active(redis, changes, monkeypatch):
+    _, dispatched = changes
+    redis.set("_state.change_number", 39)
+    redis.set(utils.cache.LISTENER, 1, ex=15)
+
+    check_changelist.check_changelist_task.run()
+
+    assert dispatched == []
+
+    redis.delete(utils.cache.LISTENER)
+    monkeypatch.setattr(
+        utils.steam,
+        "get_changes_since_change_number",
+        lambda since: {"change_number": 40, "apps": [1], "packages": []},
+    )
+    check_changelist.check_changelist_task.run()
+
+    assert len(dispatched) == 1
@@ -0,0 +1,41 @@
+"""
+Tests of the migration command of local storage.
+"""
+
+# import modules
+import migrate
+import os
+import pytest
+import utils.storage
+
+
+@pytest.fixture
+def apps(storage):
+    """
+    Return the path of the stored apps.
+    """
+
+    return storage / "app"
+
+
+def test_files_move_to_shards(apps, monkeypatch):
+    utils.storage.write_many({str(i) + ".json": "{}" for i in range(20)}, "app/")
+    monkeypatch.setattr(migrate.config, "storage_layout", "sharded")
+
+    assert migrate.migrate("app/", 3) == (20, 0)
+    assert migrate.migrate("app/", 3) == (0, 20)
+    assert not any(entry.is_file() for entry in os.scandir(apps))
+
+    monkeypatch.setattr(migrate.config, "storage_layout", "flat")
+
+    assert migrate.migrate("app/", 3) == (20, 0)
+    assert sorted(os.listdir(apps)) == sorted(str(i) + ".json" for i in range(20))
+
+
+def test_failed_write_raises(apps, monkeypatch):
+    utils.storage.write_many({"1.json": "{}"}, "app/")
+    monkeypatch.setattr(migrate.config, "storage_layout", "sharded")
+    monkeypatch.setattr(utils.storage, "local_write", lambda *args, **kwargs: False)
+
+    with pytest.raises(migrate.MigrationError):
+        migrate.migrate("app/", 3)
@@ -0,0 +1,58 @@
+"""
+Tests of the rate limit and circuit breaker scripts in Redis.
+"""
+
+# import modules
+import utils.redis
+
+
+def test_token_bucket_waits_when_empty(redis):
+    assert utils.redis.take_token("bucket", 1, 2) == 0
+    assert utils.redis.take_token("bucket", 1, 2) == 0
+    assert 0.9 < utils.redis.take_token("bucket", 1, 2) <= 1
+
+    assert 0 < redis.ttl("bucket") <= 3
+
+
+def test_token_bucket_keeps_reserve(redis):
+    assert utils.redis.take_token("bucket", 1, 2, reserve=1) == 0
+    assert utils.redis.take_token("bucket", 1, 2, reserve=1) > 0
+
+    # requests without reserve may use the reserved token
+    assert utils.redis.take_token("bucket", 1, 2) == 0
+
+
+def test_token_bucket_refills(redis):
+    redis.hset("bucket", mapping={"tokens": "0", "updated": "0"})
+
+    assert utils.redis.take_token("bucket", 1, 2) == 0
+
+
+def test_circuit_opens_after_failures(redis):
+    assert utils.redis.circuit_allow("circuit", 2, 30)
+
+    utils.redis.circuit_record("circuit", False, 2)
+    assert utils.redis.circuit_allow("circuit", 2, 30)
+
+    utils.redis.circuit_record("circuit", False, 2)
+    assert not utils.redis.circuit_allow("circuit", 2, 30)
+    assert not utils.redis.circuit_allow("circuit", 2, 30, probe=False)
+
+
+def test_half_open_circuit_lets_one_probe_through(redis):
+    redis.hset("circuit", mapping={"failures": 2, "opened": 0})
+
+    # peeking does not take the probe
+    assert utils.redis.circuit_allow("circuit", 2, 30, probe=False)
+    assert utils.redis.circuit_allow("circuit", 2, 30)
+    assert not utils.redis.circuit_allow("circuit", 2, 30)
+    assert not utils.redis.circuit_allow("circuit", 2, 30, probe=False)
+
+
+def test_success_closes_circuit(redis):
+    redis.hset("circuit", mapping={"failures": 2, "opened": 0})
+
+    utils.redis.circuit_record("circuit", True, 2)
+
+    assert not redis.exists("circuit")
+    assert utils.redis.circuit_allow("circuit", 2, 30)
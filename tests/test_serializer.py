@@ -0,0 +1,48 @@
+"""
+Tests of the byte compatibility of the JSON serializer
+with json.dumps.
+"""
+
+# import modules
+import json
+import pytest
+import utils.serializer
+
+VALUES = [
+    {"escapes": '\x00\x01\x1f\b\t\n\f\r"\\/\x7f'},
+    {"name_localized": {"french": "Éditeur", "japanese": "日本語", "emoji": "😀"}},
+    {"é": ["ü ", "a\x7fé😀b"], "": ""},
+    {"empty": {}, "list": [], "nested": [{}, [], [[]]]},
+    {"big": 2**63, "bigger": 2**64 - 1, "huge": 2**70, "negative": -(2**63)},
+    {"10": {"appid": 10, "common": None, "free": True, "paid": False}},
+    {},
+    [],
+    "text",
+]
+
+
+@pytest.mark.parametrize("value", VALUES)
+@pytest.mark.parametrize("backend", ["orjson", "json"])
+def test_pretty_equals_json_dumps(monkeypatch, value, backend):
+    monkeypatch.setattr(utils.serializer.config, "json_backend", backend)
+
+    assert utils.serializer.dumps(value, pretty=True) == json.dumps(
+        value, indent=4, sort_keys=True
+    ).encode("utf-8")
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_compact_equals_json_dumps(value):
+    assert utils.serializer.dumps(value) == json.dumps(value, sort_keys=True).encode(
+        "utf-8"
+    )
+
+
+def test_orjson_escapes_non_ascii_without_fallback():
+    content = utils.serializer._orjson_pretty({"name": "é😀"})
+
+    assert content == b'{\n    "name": "\\u00e9\\ud83d\\ude00"\n}'
+
+
+def test_loads_big_ints():
+    assert utils.serializer.loads(b'{"a": 18446744073709551616}') == {"a": 2**64}
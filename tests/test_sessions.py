@@ -0,0 +1,131 @@
+"""
+Tests of the session pool that runs Steam requests.
+"""
+
+# import modules
+import gevent
+import pytest
+import queue
+import threading
+import utils.steam
+from steam.enums import EResult
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    """
+    Replace the Steam client by a fake that logs in
+    immediately and return the list of created clients.
+    """
+
+    created = []
+
+    class SteamClient:
+        def __init__(self):
+            self.connected = False
+            self.logged_on = False
+            created.append(self)
+
+        def anonymous_login(self):
+            self.connected = self.logged_on = True
+            return EResult.OK
+
+        def logout(self):
+            self.logged_on = False
+
+        def disconnect(self):
+            self.connected = False
+
+    monkeypatch.setattr(utils.steam, "SteamClient", SteamClient)
+
+    # idle sessions must not reconnect after the test
+    monkeypatch.setattr(utils.steam.config, "steam_pool_keepalive", "3600")
+    monkeypatch.setattr(utils.steam, "_sessions_pid", None)
+    monkeypatch.setattr(utils.steam, "_jobs", queue.Queue())
+    monkeypatch.setattr(utils.steam, "_wakeups", [])
+
+    return created
+
+
+def test_requests_are_spread_over_sessions(clients):
+    utils.steam.start_sessions(2)
+    barrier = threading.Barrier(2, timeout=5)
+
+    def session_name(client):
+        # both requests must run at the same time
+        barrier.wait()
+        return threading.current_thread().name
+
+    futures = [utils.steam.request(session_name, timeout=10) for _ in range(2)]
+
+    assert {future.result(5) for future in futures} == {
+        "steam-session-0",
+        "steam-session-1",
+    }
+    assert len(clients) == 2
+
+
+def test_timeout_reconnects(clients):
+    utils.steam.start_sessions(1)
+    calls = []
+
+    def slow_once(client):
+        calls.append(client)
+        if len(calls) == 1:
+            gevent.sleep(1)
+        return "done"
+
+    assert utils.steam.request(slow_once, timeout=0.1).result(5) == "done"
+    assert calls == clients
+    assert not clients[0].connected
+
+
+def test_unhealthy_client_is_replaced(clients):
+    utils.steam.start_sessions(1)
+
+    first = utils.steam.request(lambda client: client).result(5)
+    first.logged_on = False
+    second = utils.steam.request(lambda client: client).result(5)
+
+    assert second is not first
+    assert second.logged_on
+    assert not first.connected
+
+
+def test_cancelled_request_is_skipped(clients):
+    utils.steam.start_sessions(1)
+    running = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def blocking(client):
+        running.set()
+        release.wait(5)
+        return "first"
+
+    first = utils.steam.request(blocking, timeout=10)
+    running.wait(5)
+
+    cancelled = utils.steam.request(lambda client: calls.append(client))
+    assert cancelled.cancel()
+    release.set()
+
+    assert first.result(5) == "first"
+    assert utils.steam.request(lambda client: "last").result(5) == "last"
+    assert calls == []
+
+
+def test_forked_process_starts_new_sessions(clients, monkeypatch):
+    utils.steam.start_sessions(1)
+    jobs = utils.steam._jobs
+
+    # threads don't survive a fork, the child has a new pid
+    monkeypatch.setattr(utils.steam.os, "getpid", lambda: -1)
+    monkeypatch.setattr(utils.steam.config, "steam_pool_size", "1")
+
+    name = utils.steam.request(lambda client: threading.current_thread().name)
+
+    assert name.result(5) == "steam-session-0"
+    assert utils.steam._jobs is not jobs
+    assert utils.steam._sessions_pid == -1
+    assert len(clients) == 2
@@ -0,0 +1,73 @@
+"""
+Tests of the circuit breaker and rate limit around Steam requests.
+"""
+
+# import modules
+import asyncio
+import concurrent.futures
+import pytest
+import utils.steam
+
+
+@pytest.fixture
+def request_log(monkeypatch):
+    """
+    Answer Steam requests immediately and return
+    the list of functions that were requested.
+    """
+
+    requested = []
+
+    def request(func, *args, timeout=3):
+        requested.append(func)
+        future = concurrent.futures.Future()
+        future.set_result(func(None, *args))
+        return future
+
+    monkeypatch.setattr(utils.steam, "request", request)
+
+    return requested
+
+
+def half_open(redis):
+    redis.hset(utils.steam.CIRCUIT_KEY, mapping={"failures": 5, "opened": 0})
+
+
+def rate_limited(monkeypatch):
+    def rate_limit(background=True):
+        raise utils.steam.Unavailable("Rate limit of Steam requests exceeded")
+
+    async def async_rate_limit(background=False):
+        rate_limit()
+
+    monkeypatch.setattr(utils.steam, "rate_limit", rate_limit)
+    monkeypatch.setattr(utils.steam, "async_rate_limit", async_rate_limit)
+
+
+def test_rate_limit_keeps_probe(redis, request_log, monkeypatch):
+    rate_limit = utils.steam.rate_limit
+    half_open(redis)
+    rate_limited(monkeypatch)
+
+    with pytest.raises(utils.steam.Unavailable):
+        utils.steam.call(lambda client: 1)
+    with pytest.raises(utils.steam.Unavailable):
+        asyncio.run(utils.steam.async_call(lambda client: 1))
+
+    assert redis.hget(utils.steam.CIRCUIT_KEY, "opened") == b"0"
+    assert request_log == []
+
+    monkeypatch.setattr(utils.steam, "rate_limit", rate_limit)
+
+    assert utils.steam.call(lambda client: 1) == 1
+    assert not redis.exists(utils.steam.CIRCUIT_KEY)
+
+
+def test_open_circuit_fails_without_taking_tokens(redis, request_log, monkeypatch):
+    redis.hset(utils.steam.CIRCUIT_KEY, mapping={"failures": 5, "opened": 2**40})
+    rate_limited(monkeypatch)
+
+    with pytest.raises(utils.steam.Unavailable, match="Circuit breaker"):
+        utils.steam.call(lambda client: 1)
+
+    assert request_log == []
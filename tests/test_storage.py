@@ -0,0 +1,144 @@
+"""
+Tests of persisting apps to storage with the manifest
+and of listing the stored files.
+"""
+
+# import modules
+import asyncio
+import datetime
+import os
+import types
+import utils.cache
+import utils.redis
+import utils.storage
+
+
+def stored_files(path):
+    return sorted(name for _, _, names in os.walk(path) for name in names)
+
+
+def test_unchanged_values_are_skipped(storage, redis, monkeypatch):
+    utils.cache.persist("app", [(10, b'{"10": {}}', 5), (11, b'{"11": {}}', 6)])
+    entry = redis.hget(utils.cache.MANIFEST + "app", "10")
+
+    written = []
+    write_many = utils.storage.write_many
+    monkeypatch.setattr(
+        utils.storage,
+        "write_many",
+        lambda contents, path: written.append(list(contents))
+        or write_many(contents, path),
+    )
+    utils.cache.persist("app", [(10, b'{"10": {}}', 7), (11, b'{"11": {"a": 1}}', 7)])
+
+    assert written == [["11.json"]]
+    assert redis.hget(utils.cache.MANIFEST + "app", "10") == entry
+    assert stored_files(storage) == ["10.json", "11.json"]
+
+
+def test_all_values_are_written_without_manifest(storage, redis, monkeypatch):
+    utils.cache.persist("app", [(10, b'{"10": {}}', 5)])
+    os.remove(utils.storage.local_file("app/", "10.json"))
+    monkeypatch.setattr(utils.redis, "read_fields", lambda key, fields: False)
+
+    utils.cache.persist("app", [(10, b'{"10": {}}', 5)])
+
+    assert stored_files(storage) == ["10.json"]
+
+
+def test_load_keeps_modification_time(storage, redis):
+    utils.cache.persist("app", [(10, b'{"10": {}}', 5)])
+    redis.hset(utils.cache.MANIFEST + "app", "10", "x:5:1000")
+
+    stored = asyncio.run(utils.cache.load("app", [10, 11]))
+    data = utils.cache.encode_value("app", 10, *stored[10])
+
+    assert stored == {10: (b'{"10": {}}', 1000)}
+    assert utils.cache.parse_meta(data["app.10.meta"])[1] == 1000
+
+
+def test_load_skips_storage_without_manifest(storage, redis, monkeypatch):
+    utils.cache.persist("app", [(10, b'{"10": {}}', 5)])
+
+    async def read_fields(key, fields):
+        return False
+
+    monkeypatch.setattr(utils.redis, "async_read_fields", read_fields)
+
+    assert asyncio.run(utils.cache.load("app", [10])) == {}
+
+
+def test_executor_is_created_once_per_process(monkeypatch):
+    monkeypatch.setattr(utils.storage, "_executor_pid", None)
+    monkeypatch.setattr(utils.storage, "_executor", None)
+    monkeypatch.setattr(utils.storage, "_workers", None)
+
+    pool = utils.storage.executor(3)
+
+    assert utils.storage.executor() is pool
+    assert utils.storage._workers == 3
+
+    # a forked process gets its own threads
+    monkeypatch.setattr(utils.storage.os, "getpid", lambda: -1)
+
+    assert utils.storage.executor() is not pool
+    assert utils.storage._workers == int(utils.storage.config.storage_workers)
+
+
+def test_local_list_skips_partial_files(storage):
+    utils.storage.write_many({"10.json": "{}", "11.json": "{}"}, "app/")
+    (storage / "app" / ".12.json.tmp").write_text("{}")
+
+    assert sorted(utils.storage.list("app/")) == ["10.json", "11.json"]
+
+
+def test_local_list_of_shards(storage, monkeypatch):
+    monkeypatch.setattr(utils.storage.config, "storage_layout", "sharded")
+    utils.storage.write_many({"10.json": "{}", "11.json": "{}"}, "app/")
+
+    assert [*utils.storage.list("app/")] == []
+    assert sorted(utils.storage.list("app/", recursive=True)) == sorted(
+        utils.storage.shard(name) + "/" + name for name in ["10.json", "11.json"]
+    )
+
+
+def test_local_list_details(storage):
+    utils.storage.write_many({"10.json": "{}"}, "app/")
+    stat = os.stat(storage / "app" / "10.json")
+
+    assert [*utils.storage.list("app/", details=True)] == [
+        {
+            "name": "10.json",
+            "size": stat.st_size,
+            "etag": None,
+            "modified": stat.st_mtime,
+        }
+    ]
+
+
+def test_object_list(monkeypatch):
+    listed = []
+
+    class Client:
+        def list_objects(self, bucket, prefix, recursive):
+            listed.append((prefix, recursive))
+            modified = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+            return [
+                types.SimpleNamespace(is_dir=True, object_name=prefix + "00/"),
+                types.SimpleNamespace(
+                    is_dir=False,
+                    object_name=prefix + "10.json",
+                    size=2,
+                    etag="abc",
+                    last_modified=modified,
+                ),
+            ]
+
+    monkeypatch.setattr(utils.storage.config, "storage_type", "object")
+    monkeypatch.setattr(utils.storage, "object_connect", lambda: Client())
+
+    assert [*utils.storage.list("app/")] == ["10.json"]
+    assert [*utils.storage.list("app/", details=True, recursive=True)] == [
+        {"name": "10.json", "size": 2, "etag": "abc", "modified": 1704067200.0}
+    ]
+    assert listed == [("app/", False), ("app/", True)]
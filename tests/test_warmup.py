@@ -0,0 +1,108 @@
+"""
+Tests of the warm-up command.
+"""
+
+# import modules
+import json
+import pytest
+import utils.cache
+import utils.steam
+import utils.storage
+import warmup
+
+
+@pytest.fixture
+def checkpoint(storage, tmp_path):
+    """
+    Return the path of a checkpoint file with local storage enabled.
+    """
+
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"source": "test", "position": 0}))
+
+    return str(checkpoint)
+
+
+def position(checkpoint):
+    with open(checkpoint) as file:
+        return json.load(file)["position"]
+
+
+def test_storage_rebuilds_manifest(checkpoint, redis):
+    utils.storage.write_many(
+        {"10.json": '{"10": {"_change_number": 7, "common": {}}}', "11.json": "{}"},
+        "app/",
+    )
+
+    count = warmup.warm("app", warmup.storage_batches("app", 0, 1), checkpoint, 0)
+    entries = redis.hgetall(utils.cache.MANIFEST + "app")
+
+    assert count == 2
+    assert position(checkpoint) == 2
+    assert redis.get("app.10") == b'{"10": {"_change_number": 7, "common": {}}}'
+    assert entries[b"10"].split(b":")[1] == b"7"
+    assert entries[b"11"].split(b":")[1] == b"0"
+
+
+def test_failed_batch_keeps_checkpoint(checkpoint, redis, monkeypatch, tmp_path):
+    hot = tmp_path / "hot.txt"
+    hot.write_text("10\n11\n")
+    requests = []
+
+    def call(func, *args, **kwargs):
+        requests.append(args[0])
+        if len(requests) > 1:
+            raise Exception("Max connect retries (2) exceeded")
+        return {10: {"appid": 10}}
+
+    monkeypatch.setattr(utils.steam, "call", call)
+
+    with pytest.raises(Exception):
+        warmup.warm("app", warmup.hot_batches("app", str(hot), 0, 1), checkpoint, 0)
+
+    assert requests == [[10], [11]]
+    assert position(checkpoint) == 1
+
+
+def test_manifest_only_has_stored_values(checkpoint, redis, monkeypatch, tmp_path):
+    hot = tmp_path / "hot.txt"
+    hot.write_text("10\n")
+
+    monkeypatch.setattr(
+        utils.steam, "call", lambda func, *args, **kwargs: {10: {"appid": 10}}
+    )
+    monkeypatch.setattr(
+        utils.storage,
+        "write_many",
+        lambda contents, path: {filename: False for filename in contents},
+    )
+
+    warmup.warm("app", warmup.hot_batches("app", str(hot), 0, 1), checkpoint, 0)
+
+    assert redis.get("app.10") == b'{"10": {"appid": 10}}'
+    assert not redis.exists(utils.cache.MANIFEST + "app")
+
+
+def test_expiration(checkpoint, redis):
+    utils.storage.write_many({"10.json": '{"10": {}}', "11.json": '{"11": {}}'}, "app/")
+
+    warmup.warm("app", warmup.storage_batches("app", 0, 1), checkpoint, 0)
+
+    assert redis.ttl("app.10") == -1
+    assert redis.ttl("app.11.meta") == -1
+
+    warmup.warm("app", warmup.storage_batches("app", 0, 1), checkpoint, 0, 600)
+
+    assert 0 < redis.ttl("app.10") <= 600
+
+
+def test_storage_keeps_modification_time(checkpoint, redis):
+    value = b'{"10": {"_change_number": 7}}'
+    utils.storage.write_many({"10.json": value.decode()}, "app/")
+    entry = utils.cache.digest(value) + ":7:1000"
+    redis.hset(utils.cache.MANIFEST + "app", "10", entry)
+
+    warmup.warm("app", warmup.storage_batches("app", 0, 1), checkpoint, 0)
+
+    assert utils.cache.parse_meta(redis.get("app.10.meta"))[1] == 1000
+    assert redis.hget(utils.cache.MANIFEST + "app", "10") == entry.encode()
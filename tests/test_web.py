@@ -0,0 +1,298 @@
+"""
+Tests of the info endpoints of the Web service.
+"""
+
+# import modules
+import asyncio
+import json
+import pytest
+import utils.cache
+import utils.redis
+import utils.steam
+import web
+from email.utils import formatdate
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client():
+    # without the context manager the lifespan, which logs in to Steam, is skipped
+    return TestClient(web.app)
+
+
+def big_app(app_id):
+    return {"appid": app_id, "common": {"name": "x" * 2000}}
+
+
+def test_app_is_fetched_once(client, steam, redis):
+    steam["apps"][10] = {"appid": 10}
+
+    first = client.get("/v1/info/10")
+    second = client.get("/v1/info/10")
+
+    assert first.json() == {"data": {"10": {"appid": 10}}, "status": "success"}
+    assert second.content == first.content
+    assert steam["requests"] == [[10]]
+    assert redis.get("app.10") == b'{"10": {"appid": 10}}'
+
+
+def test_gzip_is_sent_when_accepted(client, steam):
+    steam["apps"][10] = big_app(10)
+    client.get("/v1/info/10")
+
+    compressed = client.get("/v1/info/10", headers={"Accept-Encoding": "gzip"})
+    identity = client.get("/v1/info/10", headers={"Accept-Encoding": "identity"})
+    refused = client.get("/v1/info/10", headers={"Accept-Encoding": "gzip;q=0"})
+
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert "Content-Encoding" not in identity.headers
+    assert "Content-Encoding" not in refused.headers
+    assert compressed.json() == identity.json() == refused.json()
+
+
+def test_gzip_is_not_sent_for_small_apps(client, steam):
+    steam["apps"][10] = {"appid": 10}
+    client.get("/v1/info/10")
+
+    response = client.get("/v1/info/10", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
+
+
+def test_pretty_response(client, steam):
+    steam["apps"][10] = {"appid": 10}
+
+    response = client.get("/v1/info/10?pretty=true")
+
+    assert response.text == json.dumps(
+        {"data": {"10": {"appid": 10}}, "status": "success"}, indent=4, sort_keys=True
+    )
+
+
+def test_batch_response_bytes(client, steam, redis):
+    steam["apps"].update({100: {"appid": 100}, 20: {"appid": 20}})
+    utils.redis.write_many(utils.cache.encode("app", 3, {3: {"appid": 3}}))
+
+    response = client.get("/v1/info?ids=100,3,20,7")
+
+    assert response.content == json.dumps(
+        {
+            "data": {3: {"appid": 3}, 7: {}, 20: {"appid": 20}, 100: {"appid": 100}},
+            "status": "success",
+        },
+        sort_keys=True,
+    ).encode("utf-8")
+    assert steam["requests"] == [[100, 20, 7]]
+
+
+def test_batch_warms_local_cache(client, steam, redis):
+    steam["apps"][10] = big_app(10)
+    client.get("/v1/info/10")
+    utils.cache._local.clear()
+
+    client.get("/v1/info?ids=10")
+    redis.delete("app.10", "app.10.gz", "app.10.meta")
+
+    # served from the local cache with the compressed body and validators
+    response = client.get("/v1/info/10", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "ETag" in response.headers
+    assert steam["requests"] == [[10]]
+
+
+def test_batch_rejects_invalid_ids(client):
+    response = client.get("/v1/info?ids=1,x")
+
+    assert response.json()["status"] == "error"
+
+
+def test_failed_fetch_is_cached_as_false(client, steam, redis):
+    steam["apps"] = False
+
+    response = client.get("/v1/info/10")
+
+    assert response.json() == {"data": {"10": {}}, "status": "success"}
+    assert redis.get("app.10") == b"false"
+    assert redis.zscore(utils.cache.INCORRECT_APPS, "10") is not None
+
+
+def test_validators_and_not_modified(client, steam):
+    steam["apps"][10] = {"appid": 10}
+
+    response = client.get("/v1/info/10")
+    etag = response.headers["ETag"]
+    modified = response.headers["Last-Modified"]
+
+    assert etag.startswith('W/"')
+    assert client.get("/v1/info/10", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/v1/info/10", headers={"If-None-Match": "*"}).status_code == 304
+    assert (
+        client.get("/v1/info/10", headers={"If-Modified-Since": modified}).status_code
+        == 304
+    )
+
+
+def test_not_modified_without_local_cache(client, steam):
+    steam["apps"][10] = {"appid": 10}
+    etag = client.get("/v1/info/10").headers["ETag"]
+    utils.cache._local.clear()
+
+    response = client.get("/v1/info/10", headers={"If-None-Match": '"x", ' + etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+
+def test_modified_app_is_sent(client, steam):
+    steam["apps"][10] = {"appid": 10}
+    etag = client.get("/v1/info/10").headers["ETag"]
+
+    utils.redis.write_many(utils.cache.encode("app", 10, {10: {"appid": 11}}))
+    utils.cache._local.clear()
+
+    response = client.get("/v1/info/10", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_if_none_match_takes_precedence(client, steam):
+    steam["apps"][10] = {"appid": 10}
+    modified = client.get("/v1/info/10").headers["Last-Modified"]
+
+    response = client.get(
+        "/v1/info/10", headers={"If-None-Match": '"x"', "If-Modified-Since": modified}
+    )
+
+    assert response.status_code == 200
+
+
+def test_invalid_if_modified_since_is_ignored(client, steam):
+    steam["apps"][10] = {"appid": 10}
+    client.get("/v1/info/10")
+
+    response = client.get("/v1/info/10", headers={"If-Modified-Since": "yesterday"})
+
+    assert response.status_code == 200
+
+
+def test_package_in_old_format_is_served(client, redis):
+    redis.set("package.5", b'{"billingtype": 1, "packageid": 5}')
+
+    response = client.get("/v1/package/5")
+
+    assert response.json() == {
+        "data": {"5": {"billingtype": 1, "packageid": 5}},
+        "status": "success",
+    }
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("gzip", True),
+        ("deflate, gzip;q=0.5", True),
+        ("*", True),
+        ("*, gzip;q=0", False),
+        ("gzip;q=0, *", False),
+        ("gzip;q=0.000", False),
+        ("gzip; q=0.001", True),
+        ("*;q=0", False),
+        ("gzip;q=x", False),
+        ("identity", False),
+        ("", False),
+    ],
+)
+def test_accepts_gzip(header, expected):
+    request = Request(
+        {"type": "http", "headers": [(b"accept-encoding", header.encode())]}
+    )
+
+    assert web.accepts_gzip(request) is expected
+
+
+def expire(redis, key):
+    redis.delete(key, key + ".gz", key + ".meta")
+    utils.cache._local.clear()
+
+
+def test_unchanged_app_keeps_last_modified(client, steam, redis):
+    steam["apps"][10] = {"appid": 10}
+    etag = client.get("/v1/info/10").headers["ETag"]
+    redis.hset(utils.cache.VALIDATORS + "app", "10", etag + " 1000")
+    expire(redis, "app.10")
+
+    unchanged = client.get("/v1/info/10")
+
+    steam["apps"][10] = {"appid": 11}
+    expire(redis, "app.10")
+    changed = client.get("/v1/info/10")
+
+    assert unchanged.headers["ETag"] == etag
+    assert unchanged.headers["Last-Modified"] == formatdate(1000, usegmt=True)
+    assert redis.get("app.10.meta") != (etag + " 1000").encode()
+    assert changed.headers["Last-Modified"] != formatdate(1000, usegmt=True)
+
+
+@pytest.fixture
+def stale(steam, monkeypatch):
+    """
+    Cache app 10 past its expiration but within
+    the time it may be served stale.
+    """
+
+    monkeypatch.setattr(utils.redis.config, "cache_stale_expiration", "600")
+    utils.redis.write_many(utils.cache.encode("app", 10, {10: {"appid": 10}}), 300)
+    steam["apps"][10] = {"appid": 11}
+
+    return steam
+
+
+def read_stale(count=1):
+    """
+    Read app 10 count times at once and wait
+    for the refreshes started by the reads.
+    """
+
+    request = Request({"type": "http", "headers": []})
+
+    async def read():
+        responses = await asyncio.gather(
+            *(web.read_cached(request, "app", 10, False) for _ in range(count))
+        )
+        await asyncio.gather(*list(utils.cache._refreshes.values()))
+        return [json.loads(response.body) for response in responses]
+
+    return asyncio.run(read())
+
+
+def test_stale_app_is_served_and_refreshed_once(stale, redis):
+    responses = read_stale(3)
+
+    assert responses == [{"data": {"10": {"appid": 10}}, "status": "success"}] * 3
+    assert stale["requests"] == [[10]]
+    assert redis.get("app.10") == b'{"10": {"appid": 11}}'
+    assert not utils.redis.is_stale(redis.ttl("app.10"))
+
+
+def test_failed_refresh_keeps_stale_app(stale, redis):
+    stale["apps"] = False
+
+    responses = read_stale()
+
+    assert responses == [{"data": {"10": {"appid": 10}}, "status": "success"}]
+    assert redis.get("app.10") == b'{"10": {"appid": 10}}'
+
+
+def test_stale_status_while_circuit_is_open(stale, redis):
+    redis.hset(utils.steam.CIRCUIT_KEY, mapping={"failures": 5, "opened": 2**40})
+    stale["apps"] = False
+
+    responses = read_stale()
+
+    assert responses == [{"data": {"10": {"appid": 10}}, "status": "stale"}]
+    assert redis.get("app.10") == b'{"10": {"appid": 10}}'